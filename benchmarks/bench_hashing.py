@@ -0,0 +1,55 @@
+"""
+Event loop lag while passwords are hashed inline and in the worker pool
+
+    python -m benchmarks.bench_hashing [concurrency]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from src.users.utils import check_password, get_hashed_password, verify_password
+
+TICK = 0.005
+
+
+async def measure_lag(stop: asyncio.Event) -> list:
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - started - TICK) * 1000)
+    return lags
+
+
+async def inline_login(password: str, hashed: str) -> bool:
+    return verify_password(password, hashed)
+
+
+async def run(login, concurrency: int, password: str, hashed: str) -> dict:
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(TICK * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(login(password, hashed) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = sorted(await ticker)
+    return {
+        "logins": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "lag_p50_ms": round(statistics.median(lags), 2),
+        "lag_p99_ms": round(lags[int(len(lags) * 0.99) - 1], 2),
+        "lag_max_ms": round(lags[-1], 2),
+    }
+
+
+async def main(concurrency: int) -> None:
+    password = "Qwerty123!"
+    hashed = get_hashed_password(password)
+    print("inline", await run(inline_login, concurrency, password, hashed))
+    print("pool  ", await run(check_password, concurrency, password, hashed))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 16))
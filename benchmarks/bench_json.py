@@ -0,0 +1,61 @@
+"""
+Serialization of a product page: the default FastAPI path against FastJSONResponse over .values() rows.
+No database, the rows and model instances are built in memory
+
+    python -m benchmarks.bench_json [size ...]
+"""
+import json
+import sys
+import timeit
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi_pagination import Page, Params
+
+from src.pagination import raw_page
+from src.responses import FastJSONResponse, orjson
+from src.sales.models import Product, Product_Pydantic
+
+ProductPage = Page[Product_Pydantic]
+
+
+def make_rows(size: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [{"id": i, "name": f"product {i}", "price": 100 + i, "photo": f"/photo/{i}.jpg",
+             "created_at": now, "updated_at": now, "is_active": True} for i in range(1, size + 1)]
+
+
+def default_path(objects: list, params: Params) -> bytes:
+    """from_orm validation, Page, response_model validation of the dump, jsonable_encoder and json.dumps"""
+    page = ProductPage.create([Product_Pydantic.model_validate(obj) for obj in objects], params, total=len(objects))
+    validated = ProductPage.model_validate(page.model_dump())
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode()
+
+
+def model_dump_json_path(objects: list, params: Params) -> bytes:
+    page = ProductPage.create([Product_Pydantic.model_validate(obj) for obj in objects], params, total=len(objects))
+    return page.model_dump_json().encode()
+
+
+def fast_path(rows: list, params: Params) -> bytes:
+    return FastJSONResponse(raw_page(rows, len(rows), params)).body
+
+
+def main(sizes) -> None:
+    print(f"encoder: {'orjson' if orjson is not None else 'pydantic-core'}")
+    for size in sizes:
+        rows = make_rows(size)
+        objects = [Product(**row) for row in rows]
+        params = Params.model_construct(page=1, size=size)
+        assert json.loads(fast_path(rows, params)) == json.loads(default_path(objects, params))
+        number = max(1, 2000 // size)
+        for name, run in (("default", lambda: default_path(objects, params)),
+                          ("model_dump_json", lambda: model_dump_json_path(objects, params)),
+                          ("fast", lambda: fast_path(rows, params))):
+            best = min(timeit.repeat(run, number=number, repeat=5)) / number
+            print(f"{size:6} items  {name:16} {best * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [50, 1000])
@@ -0,0 +1,171 @@
+"""
+Throughput and latency of the main endpoints, the app runs in process and is driven with httpx
+
+    python -m benchmarks.bench_load [--users 50] [--products 500] [--deals 20] [--requests 1000]
+                                   [--concurrency 32] [--db-url sqlite://bench.db] [--out results.json]
+                                   [--compare previous.json]
+
+Seeded rows are named bench_<run>_* and removed at the end unless --keep is given
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+from asgi_lifespan import LifespanManager
+from httpx import AsyncClient
+
+from src import config
+from src.main import app
+from src.sales.models import Deal, Product
+from src.users.models import User
+from src.users.utils import create_access_token, get_hashed_password
+
+PASSWORD = "Qwerty123!"
+
+
+class Dataset:
+    def __init__(self, run: int):
+        self.run = run
+        self.users: List[User] = []
+        self.headers: List[dict] = []
+        self.product_ids: List[int] = []
+
+    async def seed(self, users: int, products: int, deals: int) -> None:
+        hashed = get_hashed_password(PASSWORD)
+        await User.bulk_create([User(full_name=f"bench_{self.run}_{i}", email=f"bench_{self.run}_{i}@bench.com",
+                                     phone=f"+79{self.run:03d}{i:06d}", hashed_password=hashed)
+                                for i in range(users)])
+        await Product.bulk_create([Product(name=f"bench_{self.run}_{i}", price=random.randint(1, 10000), photo="")
+                                   for i in range(products)])
+        self.users = await User.filter(email__startswith=f"bench_{self.run}_")
+        self.headers = [{"Authorization": f"Bearer {create_access_token(u.email, user=u)}"} for u in self.users]
+        self.product_ids = await Product.filter(name__startswith=f"bench_{self.run}_").values_list("id", flat=True)
+        prices = dict(await Product.filter(id__in=self.product_ids).values_list("id", "price"))
+        rows = []
+        for user in self.users:
+            for p_id in random.choices(self.product_ids, k=deals):
+                count = random.randint(1, 5)
+                rows.append(Deal(user_id=user.id, product_id=p_id, count=count, price=prices[p_id] * count))
+        await Deal.bulk_create(rows, batch_size=config.BULK_CHUNK_SIZE)
+
+    async def drop(self) -> None:
+        await User.filter(email__startswith=f"bench_{self.run}_").delete()
+        await Deal.filter(product_id__in=self.product_ids).delete()
+        await Product.filter(id__in=self.product_ids).delete()
+
+
+def scenarios(data: Dataset) -> Dict[str, Callable]:
+    def login(client, i):
+        user = data.users[i % len(data.users)]
+        return client.post("/users/login", json={"email_or_phone": user.email, "password": PASSWORD})
+
+    def product_list(client, i):
+        return client.get(f"/product/product_list?page={i % 5 + 1}&size=50", headers=data.headers[i % len(data.headers)])
+
+    def product_get(client, i):
+        return client.get(f"/product/{random.choice(data.product_ids)}", headers=data.headers[i % len(data.headers)])
+
+    def basket(client, i):
+        return client.get("/product/deal/0", headers=data.headers[i % len(data.headers)])
+
+    def deal_create(client, i):
+        return client.post(f"/product/deal/{random.choice(data.product_ids)}&1",
+                           headers=data.headers[i % len(data.headers)])
+
+    return {"login": login, "product_list": product_list, "product_get": product_get,
+            "basket": basket, "deal_create": deal_create}
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def drive(client: AsyncClient, request: Callable, total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    issued = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in issued:
+            started = time.perf_counter()
+            response = await request(client, i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def compare(results: dict, previous: dict) -> None:
+    for name, current in results["endpoints"].items():
+        before = previous.get("endpoints", {}).get(name)
+        if before:
+            print(f"{name:14} rps {before['rps']:>9} -> {current['rps']:>9}   "
+                  f"p99 {before['p99_ms']:>8} -> {current['p99_ms']:>8} ms")
+
+
+async def main(args) -> dict:
+    if args.db_url:
+        config.DATABASE_CONFIG["connections"]["default"] = args.db_url
+    data = Dataset(random.randint(0, 999))
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "endpoints": {},
+    }
+    async with LifespanManager(app):
+        await data.seed(args.users, args.products, args.deals)
+        try:
+            async with AsyncClient(app=app, base_url="http://bench") as client:
+                for name, request in scenarios(data).items():
+                    if args.only and name not in args.only:
+                        continue
+                    await drive(client, request, min(args.concurrency, args.requests), args.concurrency)  # warm up
+                    results["endpoints"][name] = await drive(client, request, args.requests, args.concurrency)
+                    print(f"{name:14} {results['endpoints'][name]}")
+        finally:
+            if not args.keep:
+                await data.drop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--deals", type=int, default=20, help="deals per user")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--only", nargs="*", help="endpoints to run")
+    parser.add_argument("--db-url", help="database to seed and run against instead of DATABASE_CONFIG")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+    parser.add_argument("--out", default="benchmarks/results.json")
+    parser.add_argument("--compare", help="previous results JSON")
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,77 @@
+"""
+Cold start of a worker: interpreter start, app import, lifespan startup and the first served request.
+Every run is a fresh process, development mode (generate_schemas) runs first and creates the schema
+that production mode then expects from migrations
+
+    python -m benchmarks.bench_startup [--runs 5] [--path /metrics] [--db-url sqlite://bench.db]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+from src import config
+if sys.argv[2]:
+    config.DATABASE_CONFIG["connections"]["default"] = sys.argv[2]
+from src.main import app
+imported = time.perf_counter()
+from asgi_lifespan import LifespanManager
+from httpx import AsyncClient
+
+
+async def main():
+    async with LifespanManager(app):
+        ready = time.perf_counter()
+        async with AsyncClient(app=app, base_url="http://bench") as client:
+            response = await client.get(sys.argv[1])
+        served = time.perf_counter()
+    print(json.dumps({"status": response.status_code, "import_s": imported - started,
+                      "startup_s": ready - imported, "first_request_s": served - ready}))
+
+asyncio.run(main())
+"""
+
+MODES = {
+    "development": {"APP_MODE": "development", "GENERATE_SCHEMAS": "true"},
+    "production": {"APP_MODE": "production", "GENERATE_SCHEMAS": "false"},
+}
+
+
+def cold_start(mode: str, path: str, db_url: str) -> dict:
+    env = {**os.environ, **MODES[mode], "MAIL_QUEUE_ENABLED": "false"}
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, path, db_url or ""], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["total_s"] = time.perf_counter() - started
+    return result
+
+
+def main(args) -> dict:
+    results = {}
+    for mode in MODES:
+        runs = [cold_start(mode, args.path, args.db_url) for _ in range(args.runs)]
+        results[mode] = {key: round(statistics.median(run[key] for run in runs) * 1000, 1)
+                         for key in ("import_s", "startup_s", "first_request_s", "total_s")}
+        results[mode]["status"] = runs[-1]["status"]
+        print(f"{mode:12} median ms {results[mode]}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/metrics", help="GET path of the first request")
+    parser.add_argument("--db-url", help="database to start against instead of DATABASE_CONFIG")
+    parser.add_argument("--out", help="save results as JSON")
+    args = parser.parse_args()
+    results = main(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
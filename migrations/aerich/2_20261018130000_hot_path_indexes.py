@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_deal_user_id_bd2ebe" ON "deal" ("user_id", "id");
+CREATE INDEX IF NOT EXISTS "idx_deal_product_81017a" ON "deal" ("product_id");
+CREATE INDEX IF NOT EXISTS "idx_product_name_active" ON "product" ("name") WHERE is_active = true;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_deal_user_id_bd2ebe";
+DROP INDEX IF EXISTS "idx_deal_product_81017a";
+DROP INDEX IF EXISTS "idx_product_name_active";"""
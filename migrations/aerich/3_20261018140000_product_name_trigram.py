@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # the indexed expression is the one Tortoise builds for name__icontains / name__istartswith
+    if db.capabilities.dialect != "postgres":
+        return ""
+    return """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS "idx_product_name_trgm" ON "product" USING GIN (UPPER(CAST("name" AS VARCHAR)) gin_trgm_ops);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    if db.capabilities.dialect != "postgres":
+        return ""
+    return """
+        DROP INDEX IF EXISTS "idx_product_name_trgm";"""
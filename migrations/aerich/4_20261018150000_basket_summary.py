@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "basketsummary" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "count" INT NOT NULL  DEFAULT 0,
+    "total" INT NOT NULL  DEFAULT 0,
+    "user_id" INT NOT NULL UNIQUE REFERENCES "user" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "basketsummary" IS 'Count and price of the user''s basket, changed together with Deal rows';
+INSERT INTO "basketsummary" ("user_id", "count", "total")
+    SELECT "user_id", SUM("count"), SUM("price") FROM "deal" GROUP BY "user_id";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "basketsummary";"""
@@ -0,0 +1,42 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "deal" ADD "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS "idx_deal_created_7a13d0" ON "deal" ("created_at");
+CREATE TABLE IF NOT EXISTS "product_sales_daily" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "day" DATE NOT NULL,
+    "deals" INT NOT NULL  DEFAULT 0,
+    "units" BIGINT NOT NULL  DEFAULT 0,
+    "revenue" BIGINT NOT NULL  DEFAULT 0,
+    "product_id" INT NOT NULL REFERENCES "product" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_product_sal_day_8b27e7" UNIQUE ("day", "product_id")
+);
+COMMENT ON TABLE "product_sales_daily" IS 'Units and revenue of a product per day, rebuilt from Deal by refresh_rollups';
+CREATE TABLE IF NOT EXISTS "user_spend_daily" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "day" DATE NOT NULL,
+    "deals" INT NOT NULL  DEFAULT 0,
+    "units" BIGINT NOT NULL  DEFAULT 0,
+    "spend" BIGINT NOT NULL  DEFAULT 0,
+    "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_user_spend__user_id_3088ee" UNIQUE ("user_id", "day")
+);
+COMMENT ON TABLE "user_spend_daily" IS 'Units and spend of a user per day, rebuilt from Deal by refresh_rollups';
+CREATE TABLE IF NOT EXISTS "rollup_state" (
+    "name" VARCHAR(50) NOT NULL  PRIMARY KEY,
+    "last_deal_id" INT NOT NULL  DEFAULT 0,
+    "refreshed_at" TIMESTAMPTZ
+);
+COMMENT ON TABLE "rollup_state" IS 'Highest Deal.id already rolled up and the time of the last refresh';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "rollup_state";
+DROP TABLE IF EXISTS "user_spend_daily";
+DROP TABLE IF EXISTS "product_sales_daily";
+DROP INDEX IF EXISTS "idx_deal_created_7a13d0";
+ALTER TABLE "deal" DROP COLUMN "created_at";"""
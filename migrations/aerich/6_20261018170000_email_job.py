@@ -0,0 +1,25 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "email_job" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "recipients" JSONB NOT NULL,
+    "subject" VARCHAR(255) NOT NULL,
+    "body" TEXT NOT NULL,
+    "subtype" VARCHAR(10) NOT NULL  DEFAULT 'html',
+    "status" VARCHAR(10) NOT NULL  DEFAULT 'pending',
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "last_error" TEXT,
+    "run_at" TIMESTAMPTZ NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "sent_at" TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS "idx_email_job_status_b7cf43" ON "email_job" ("status", "run_at");
+COMMENT ON TABLE "email_job" IS 'Email waiting to be sent by the mail worker, the table keeps pending jobs across restarts';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "email_job";"""
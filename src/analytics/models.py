@@ -0,0 +1,45 @@
+from tortoise import fields, models
+
+
+class ProductSalesDaily(models.Model):
+    """
+    Units and revenue of a product per day, rebuilt from Deal by refresh_rollups
+    """
+    id = fields.IntField(pk=True)
+    day = fields.DateField()
+    product = fields.ForeignKeyField("sales.Product", on_delete=fields.CASCADE, related_name=False)
+    deals = fields.IntField(default=0)
+    units = fields.BigIntField(default=0)
+    revenue = fields.BigIntField(default=0)
+
+    class Meta:
+        table = "product_sales_daily"
+        unique_together = (("day", "product"), )
+
+
+class UserSpendDaily(models.Model):
+    """
+    Units and spend of a user per day, rebuilt from Deal by refresh_rollups
+    """
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField("users.User", on_delete=fields.CASCADE, related_name=False)
+    day = fields.DateField()
+    deals = fields.IntField(default=0)
+    units = fields.BigIntField(default=0)
+    spend = fields.BigIntField(default=0)
+
+    class Meta:
+        table = "user_spend_daily"
+        unique_together = (("user", "day"), )
+
+
+class RollupState(models.Model):
+    """
+    Highest Deal.id already rolled up and the time of the last refresh
+    """
+    name = fields.CharField(max_length=50, pk=True)
+    last_deal_id = fields.IntField(default=0)
+    refreshed_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "rollup_state"
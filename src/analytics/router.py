@@ -0,0 +1,59 @@
+from datetime import date
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, Query
+from starlette.exceptions import HTTPException
+
+from src.analytics.schemas import ProductSales, RefreshResult, UserSpend
+from src.analytics.utils import ensure_fresh, product_sales, refresh_rollups, user_spend
+from src.users.models import User
+from src.users.utils import get_current_user
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"]
+)
+
+
+@router.get("/products", summary="Revenue and units per Product for Staff User", response_model=List[ProductSales])
+async def get_product_sales(date_from: Optional[date] = None, date_to: Optional[date] = None,
+                            order_by: Literal["revenue", "units", "deals"] = "revenue",
+                            limit: int = Query(50, ge=1, le=1000), offset: int = Query(0, ge=0),
+                            current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        await ensure_fresh()
+        return await product_sales(date_from, date_to, order_by, limit, offset)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.get("/top_products", summary="Top N Products by revenue or units for Staff User",
+            response_model=List[ProductSales])
+async def get_top_products(n: int = Query(10, ge=1, le=100), by: Literal["revenue", "units"] = "revenue",
+                           date_from: Optional[date] = None, date_to: Optional[date] = None,
+                           current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        await ensure_fresh()
+        return await product_sales(date_from, date_to, by, n)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.get("/users/{user_id}/spend", summary="Spend of User over time for Staff User", response_model=UserSpend)
+async def get_user_spend(user_id: int, period: Literal["day", "week", "month"] = "day",
+                         date_from: Optional[date] = None, date_to: Optional[date] = None,
+                         current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        await ensure_fresh()
+        points = await user_spend(user_id, period, date_from, date_to)
+        return UserSpend(user_id=user_id, period=period, points=points, total=sum(p.spend for p in points))
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.post("/refresh", summary="Refresh sales rollups for Staff User", response_model=RefreshResult)
+async def refresh(full: bool = False, current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        return await refresh_rollups(full)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
@@ -0,0 +1,31 @@
+from datetime import date
+from typing import List, Literal
+
+from pydantic import BaseModel
+
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: str
+    deals: int
+    units: int
+    revenue: int
+
+
+class SpendPoint(BaseModel):
+    period: date
+    deals: int
+    units: int
+    spend: int
+
+
+class UserSpend(BaseModel):
+    user_id: int
+    period: Literal["day", "week", "month"]
+    points: List[SpendPoint]
+    total: int
+
+
+class RefreshResult(BaseModel):
+    days: int
+    last_deal_id: int
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional
+
+from tortoise import BaseDBAsyncClient
+from tortoise.functions import Count, Max, Min, Sum
+
+from src import config
+from src.db import write_transaction
+from src.analytics.models import ProductSalesDaily, RollupState, UserSpendDaily
+from src.analytics.schemas import ProductSales, RefreshResult, SpendPoint
+from src.conditional import to_datetime
+from src.sales.models import Deal, Product
+
+ROLLUP = "daily"
+
+# one refresh per process at a time, the row lock on RollupState serializes the workers
+_refresh_lock = asyncio.Lock()
+_background: Optional[asyncio.Task] = None
+logger = logging.getLogger(__name__)
+
+
+def day_range(day: date):
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def is_stale(state: Optional[RollupState], max_age: float) -> bool:
+    return state is None or state.refreshed_at is None or \
+        datetime.now(timezone.utc) - to_datetime(state.refreshed_at) > timedelta(seconds=max_age)
+
+
+async def _rebuild_day(conn: BaseDBAsyncClient, day: date) -> None:
+    """Replace the rollup rows of one day with GROUP BY aggregates over its deals"""
+    start, end = day_range(day)
+    deals = Deal.filter(created_at__gte=start, created_at__lt=end).using_db(conn)
+    products = await deals.annotate(deals=Count("id"), units=Sum("count"), revenue=Sum("price")) \
+        .group_by("product_id").order_by("product_id").values("product_id", "deals", "units", "revenue")
+    users = await deals.annotate(deals=Count("id"), units=Sum("count"), spend=Sum("price")) \
+        .group_by("user_id").order_by("user_id").values("user_id", "deals", "units", "spend")
+    await ProductSalesDaily.filter(day=day).using_db(conn).delete()
+    await UserSpendDaily.filter(day=day).using_db(conn).delete()
+    await ProductSalesDaily.bulk_create([ProductSalesDaily(day=day, **row) for row in products],
+                                        batch_size=config.BULK_CHUNK_SIZE, using_db=conn)
+    await UserSpendDaily.bulk_create([UserSpendDaily(day=day, **row) for row in users],
+                                     batch_size=config.BULK_CHUNK_SIZE, using_db=conn)
+
+
+async def refresh_rollups(full: bool = False, max_age: Optional[float] = None) -> RefreshResult:
+    """
+    Rebuild the days that got new deals since the last refresh plus the last ANALYTICS_REFRESH_DAYS days,
+    which also picks up deleted deals. full=True rebuilds every day from the first deal.
+    With max_age nothing is rebuilt when another worker refreshed within max_age seconds
+    """
+    async with _refresh_lock:
+        await RollupState.get_or_create(name=ROLLUP)
+        async with write_transaction() as conn:
+            state = await RollupState.filter(name=ROLLUP).select_for_update().using_db(conn).get()
+            if max_age is not None and not is_stale(state, max_age):
+                return RefreshResult(days=0, last_deal_id=state.last_deal_id)
+            query = Deal.all() if full or state.refreshed_at is None else Deal.filter(id__gt=state.last_deal_id)
+            meta = await query.using_db(conn).annotate(last_id=Max("id"), first_at=Min("created_at")).first() \
+                .values("last_id", "first_at")
+            today = datetime.now(timezone.utc).date()
+            start = today - timedelta(days=max(config.ANALYTICS_REFRESH_DAYS, 1) - 1)
+            if meta["first_at"] is not None:
+                start = min(start, to_datetime(meta["first_at"]).date())
+            day = start
+            while day <= today:
+                await _rebuild_day(conn, day)
+                day += timedelta(days=1)
+            state.last_deal_id = max(meta["last_id"] or 0, state.last_deal_id)
+            state.refreshed_at = datetime.now(timezone.utc)
+            await state.save(using_db=conn)
+        return RefreshResult(days=(today - start).days + 1, last_deal_id=state.last_deal_id)
+
+
+async def _refresh_in_background() -> None:
+    try:
+        await refresh_rollups(max_age=config.ANALYTICS_MAX_STALENESS)
+    except Exception:
+        logger.exception("rollup refresh failed")
+
+
+async def ensure_fresh() -> None:
+    """
+    Rollups that were never built are built before answering. Ones older than ANALYTICS_MAX_STALENESS
+    seconds are served as they are while a background task refreshes them
+    """
+    global _background
+    state = await RollupState.filter(name=ROLLUP).first()
+    if state is None or state.refreshed_at is None:
+        await refresh_rollups(max_age=config.ANALYTICS_MAX_STALENESS)
+    elif is_stale(state, config.ANALYTICS_MAX_STALENESS) and (_background is None or _background.done()):
+        _background = asyncio.create_task(_refresh_in_background())
+
+
+async def product_sales(date_from: Optional[date], date_to: Optional[date], order_by: str,
+                        limit: int, offset: int = 0) -> List[ProductSales]:
+    query = ProductSalesDaily.all()
+    if date_from:
+        query = query.filter(day__gte=date_from)
+    if date_to:
+        query = query.filter(day__lte=date_to)
+    rows = await query.annotate(total_deals=Sum("deals"), total_units=Sum("units"), total_revenue=Sum("revenue")) \
+        .group_by("product_id").order_by(f"-total_{order_by}", "product_id").offset(offset).limit(limit) \
+        .values("product_id", "total_deals", "total_units", "total_revenue")
+    names = dict(await Product.filter(id__in=[row["product_id"] for row in rows]).values_list("id", "name"))
+    return [ProductSales(product_id=row["product_id"], name=names.get(row["product_id"], ""),
+                         deals=row["total_deals"], units=row["total_units"], revenue=row["total_revenue"])
+            for row in rows]
+
+
+def period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+async def user_spend(user_id: int, period: str, date_from: Optional[date], date_to: Optional[date]) -> List[SpendPoint]:
+    query = UserSpendDaily.filter(user_id=user_id)
+    if date_from:
+        query = query.filter(day__gte=date_from)
+    if date_to:
+        query = query.filter(day__lte=date_to)
+    points: Dict[date, SpendPoint] = {}
+    for row in await query.order_by("day").values("day", "deals", "units", "spend"):
+        key = period_start(row["day"], period)
+        point = points.get(key)
+        if point is None:
+            points[key] = SpendPoint(period=key, deals=row["deals"], units=row["units"], spend=row["spend"])
+        else:
+            point.deals += row["deals"]
+            point.units += row["units"]
+            point.spend += row["spend"]
+    return list(points.values())
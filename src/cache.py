@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a time-to-live for every entry
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class CacheError(Exception):
+    pass
+
+
+# a failing backend is logged and treated as a miss, it never fails the request
+BACKEND_ERRORS = (OSError, asyncio.TimeoutError, CacheError)
+
+
+class CacheBackend:
+    """
+    Async key-value cache, values are stored as JSON
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Any:
+        try:
+            raw = await self._get(self.prefix + key)
+        except BACKEND_ERRORS as ex:
+            logger.warning("cache get %s failed: %s", key, ex)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await self._set(self.prefix + key, json.dumps(value, separators=(",", ":")), ttl)
+        except BACKEND_ERRORS as ex:
+            logger.warning("cache set %s failed: %s", key, ex)
+
+    async def delete(self, *keys: str) -> None:
+        try:
+            await self._delete(*(self.prefix + key for key in keys))
+        except BACKEND_ERRORS as ex:
+            logger.warning("cache delete %s failed: %s", keys, ex)
+
+    async def incr(self, key: str) -> Optional[int]:
+        try:
+            return await self._incr(self.prefix + key)
+        except BACKEND_ERRORS as ex:
+            logger.warning("cache incr %s failed: %s", key, ex)
+            return None
+
+    async def get_int(self, key: str) -> int:
+        """Counter value without touching hit/miss statistics"""
+        try:
+            raw = await self._get(self.prefix + key)
+        except BACKEND_ERRORS as ex:
+            logger.warning("cache get %s failed: %s", key, ex)
+            raw = None
+        return int(raw or 0)
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "hits": self.hits, "misses": self.misses}
+
+    async def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def _delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def _incr(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    Per process backend, invalidations stay inside one worker.
+    Counters live outside the LRU, an evicted generation would bring old entries back
+    """
+
+    def __init__(self, maxsize: int = 1024, prefix: str = ""):
+        super().__init__(prefix)
+        self._data = TTLCache(maxsize, ttl=60)
+        self._counters: Dict[str, int] = {}
+
+    async def _get(self, key: str) -> Optional[str]:
+        if key in self._counters:
+            return str(self._counters[key])
+        return self._data.get(key)
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        self._counters.pop(key, None)
+        self._data.set(key, value, ttl)
+
+    async def _delete(self, *keys: str) -> None:
+        for key in keys:
+            self._counters.pop(key, None)
+            self._data.pop(key)
+
+    async def _incr(self, key: str) -> int:
+        value = self._counters.get(key, 0) + 1
+        self._counters[key] = value
+        return value
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._data), "maxsize": self._data.maxsize}
+
+
+class RedisCache(CacheBackend):
+    """
+    Shared backend speaking the Redis protocol (RESP2), every worker sees the same keys
+    """
+
+    def __init__(self, url: str, pool_size: int = 10, prefix: str = "", timeout: float = 1):
+        super().__init__(prefix)
+        self.timeout = timeout
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.pool_size = pool_size
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def execute(self, *args: Any) -> Any:
+        try:
+            conn = self._idle.pop()
+        except IndexError:
+            conn = await self._connect()
+        try:
+            result = await asyncio.wait_for(self._call(conn, *args), self.timeout)
+        except BaseException:
+            conn[1].close()
+            raise
+        if len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+        return result
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop()[1].close()
+
+    async def _connect(self):
+        conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            if self.password:
+                await asyncio.wait_for(self._call(conn, "AUTH", self.password), self.timeout)
+            if self.db:
+                await asyncio.wait_for(self._call(conn, "SELECT", self.db), self.timeout)
+        except BaseException:
+            conn[1].close()
+            raise
+        return conn
+
+    async def _call(self, conn, *args: Any) -> Any:
+        reader, writer = conn
+        command = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        writer.write(b"".join(command))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise CacheError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            return (await reader.readexactly(size + 2))[:-2].decode()
+        if kind == b"*":
+            size = int(rest)
+            if size < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(size)]
+        raise CacheError(f"Unknown reply {line!r}")
+
+    async def _get(self, key: str) -> Optional[str]:
+        return await self.execute("GET", key)
+
+    async def _set(self, key: str, value: str, ttl: float) -> None:
+        await self.execute("SET", key, value, "PX", int(ttl * 1000))
+
+    async def _delete(self, *keys: str) -> None:
+        if keys:
+            await self.execute("DEL", *keys)
+
+    async def _incr(self, key: str) -> int:
+        return await self.execute("INCR", key)
+
+
+def create_cache(url: str, prefix: str = "", maxsize: int = 1024, timeout: float = 1) -> CacheBackend:
+    if url.startswith("memory://"):
+        return MemoryCache(maxsize, prefix=prefix)
+    if url.startswith("redis://"):
+        return RedisCache(url, prefix=prefix, timeout=timeout)
+    raise ValueError(f"Unsupported cache url {url}")
+
+
+cache = create_cache(config.CACHE_URL, prefix=config.CACHE_PREFIX, maxsize=config.CACHE_SIZE,
+                     timeout=config.CACHE_TIMEOUT)
@@ -1,8 +1,13 @@
 from os import getenv
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# production boots without schema generation, the schema comes from aerich migrations
+APP_MODE = getenv("APP_MODE", "development")
+GENERATE_SCHEMAS = getenv("GENERATE_SCHEMAS", str(APP_MODE != "production")).lower() in ("1", "true")
+
 DB_HOST = getenv("DB_HOST")
 DB_PORT = getenv("DB_PORT")
 DB_NAME = getenv("DB_NAME")
@@ -11,9 +16,36 @@ DB_PASS = getenv("DB_PASS")
 
 DATABASE_URL = f"postgres://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+DB_POOL_MIN_SIZE = int(getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(getenv("DB_POOL_MAX_SIZE", 5))
+DB_POOL_MAX_IDLE_LIFETIME = float(getenv("DB_POOL_MAX_IDLE_LIFETIME", 300))
+DB_COMMAND_TIMEOUT = float(getenv("DB_COMMAND_TIMEOUT", 60))
+DB_STATEMENT_CACHE_SIZE = int(getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+DATABASE_CONNECTION = {
+    "engine": "tortoise.backends.asyncpg",
+    "credentials": {
+        "host": DB_HOST,
+        "port": DB_PORT,
+        "user": DB_USER,
+        "password": DB_PASS,
+        "database": DB_NAME,
+        "minsize": DB_POOL_MIN_SIZE,
+        "maxsize": DB_POOL_MAX_SIZE,
+        # the rest goes to asyncpg.create_pool as is
+        "max_inactive_connection_lifetime": DB_POOL_MAX_IDLE_LIFETIME,
+        "command_timeout": DB_COMMAND_TIMEOUT,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    },
+}
+
+DB_REPLICA_URL = getenv("DB_REPLICA_URL")
+# seconds a client keeps reading from the primary after its own write
+DB_REPLICA_STICKY_SECONDS = int(getenv("DB_REPLICA_STICKY_SECONDS", 5))
+
 DATABASE_CONFIG = {
     "connections": {
-        "default": DATABASE_URL,
+        "default": DATABASE_CONNECTION,
     },
     "apps": {
         "aerich": {
@@ -28,19 +60,88 @@ DATABASE_CONFIG = {
             "models": ["src.sales.models"],
             "default_connection": "default",
         },
+        "analytics": {
+            "models": ["src.analytics.models"],
+            "default_connection": "default",
+        },
+        "mail": {
+            "models": ["src.mail.models"],
+            "default_connection": "default",
+        },
     },
 }
 
+if DB_REPLICA_URL:
+    replica = urlparse(DB_REPLICA_URL)
+    DATABASE_CONFIG["connections"]["replica"] = {
+        "engine": "tortoise.backends.asyncpg",
+        "credentials": {
+            **DATABASE_CONNECTION["credentials"],
+            "host": replica.hostname,
+            "port": replica.port or 5432,
+            "user": replica.username or DB_USER,
+            "password": replica.password or DB_PASS,
+            "database": replica.path.lstrip("/") or DB_NAME,
+        },
+    }
+    DATABASE_CONFIG["routers"] = ["src.db.ReplicaRouter"]
+
 
 JWT_SECRET_KEY = getenv("JWT_SECRET_KEY")
 VERIFY_SECRET_KEY = getenv("VERIFY_SECRET_KEY")
 ALGORITHM = getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+# put user id, role and token version into access tokens for the read-only fast path
+JWT_USER_CLAIMS = getenv("JWT_USER_CLAIMS", "false").lower() in ("1", "true")
+
+COUNT_CACHE_TTL = int(getenv("COUNT_CACHE_TTL", 30))
+CACHE_URL = getenv("CACHE_URL", "memory://")
+CACHE_PREFIX = getenv("CACHE_PREFIX", "sales:")
+CACHE_SIZE = int(getenv("CACHE_SIZE", 1024))
+CACHE_TIMEOUT = float(getenv("CACHE_TIMEOUT", 1))
+USER_CACHE_TTL = int(getenv("USER_CACHE_TTL", 60))
+PRODUCT_CACHE_TTL = int(getenv("PRODUCT_CACHE_TTL", 60))
+PRODUCT_CACHE_CONTROL = getenv("PRODUCT_CACHE_CONTROL", "private, no-cache")
+
+# first scheme hashes new passwords, the rest are only verified and rehashed on login
+PASSWORD_SCHEMES = [scheme.strip() for scheme in getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if scheme.strip()]
+BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", 12))
+ARGON2_TIME_COST = int(getenv("ARGON2_TIME_COST", 2))
+ARGON2_MEMORY_COST = int(getenv("ARGON2_MEMORY_COST", 102400))
+ARGON2_PARALLELISM = int(getenv("ARGON2_PARALLELISM", 8))
+
+METRICS_ENABLED = getenv("METRICS_ENABLED", "true").lower() in ("1", "true")
+# off, header (opt in per request with X-Profile-Queries: 1) or on
+PROFILE_QUERIES = getenv("PROFILE_QUERIES", "off")
+SLOW_QUERY_MS = float(getenv("SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+# rollups older than this are refreshed on read, every refresh rebuilds the last ANALYTICS_REFRESH_DAYS days
+ANALYTICS_MAX_STALENESS = int(getenv("ANALYTICS_MAX_STALENESS", 300))
+ANALYTICS_REFRESH_DAYS = int(getenv("ANALYTICS_REFRESH_DAYS", 2))
+
+BULK_CHUNK_SIZE = int(getenv("BULK_CHUNK_SIZE", 1000))
+EXPORT_CHUNK_SIZE = int(getenv("EXPORT_CHUNK_SIZE", 1000))
+
+HASH_POOL = getenv("HASH_POOL", "thread")
+HASH_WORKERS = int(getenv("HASH_WORKERS", 4))
+HASH_QUEUE_SIZE = int(getenv("HASH_QUEUE_SIZE", 64))
 
 EMAIL_HOST = getenv('EMAIL_HOST')
 EMAIL_PORT = int(getenv('EMAIL_PORT'))
 EMAIL_HOST_USER = getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = getenv('EMAIL_HOST_PASSWORD')
+EMAIL_USE_TLS = getenv("EMAIL_USE_TLS", "true").lower() in ("1", "true")
+EMAIL_TIMEOUT = int(getenv("EMAIL_TIMEOUT", 30))
+
+MAIL_QUEUE_ENABLED = getenv("MAIL_QUEUE_ENABLED", "true").lower() in ("1", "true")
+MAIL_BATCH_SIZE = int(getenv("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_ATTEMPTS = int(getenv("MAIL_MAX_ATTEMPTS", 5))
+# retry after MAIL_RETRY_SECONDS * 2 ** (attempts - 1)
+MAIL_RETRY_SECONDS = int(getenv("MAIL_RETRY_SECONDS", 30))
+# a job claimed by a worker that died is sent again after this time
+MAIL_LOCK_SECONDS = int(getenv("MAIL_LOCK_SECONDS", 300))
+MAIL_POLL_SECONDS = int(getenv("MAIL_POLL_SECONDS", 10))
 
 
 DB_HOST_TEST = getenv("DB_HOST_TEST")
@@ -0,0 +1,114 @@
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from typing import Dict, Optional
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient, BaseTransactionWrapper
+from tortoise.exceptions import ConfigurationError
+from tortoise.transactions import in_transaction
+
+PRIMARY_COOKIE = "read_primary"
+
+# per request {"pinned": client wrote recently, "wrote": request has written}
+_primary_reads: ContextVar[Optional[dict]] = ContextVar("primary_reads", default=None)
+
+
+def pool_stats() -> Dict[str, dict]:
+    """
+    Live numbers of every asyncpg pool: connections in use, idle ones and coroutines waiting for a connection
+    """
+    stats = {}
+    for conn in connections.all():
+        pool = getattr(conn, "_pool", None)
+        if pool is None:
+            continue
+        size, idle = pool.get_size(), pool.get_idle_size()
+        stats[conn.connection_name] = {
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiters": len(getattr(pool._queue, "_getters", ())),
+        }
+    return stats
+
+
+def primary() -> BaseDBAsyncClient:
+    """
+    Connection for reads that must not lag behind writes, like the auth state of a user that is then cached
+    """
+    return connections.get("default")
+
+
+def mark_written() -> None:
+    """The request has written, its next reads and the client's next requests go to the primary"""
+    state = _primary_reads.get()
+    if state is not None:
+        state["wrote"] = True
+
+
+def write_transaction():
+    """
+    in_transaction on the primary that counts as a write of the request. Queries given the transaction
+    connection explicitly never reach ReplicaRouter.db_for_write, so the write is marked here
+    """
+    mark_written()
+    return in_transaction("default")
+
+
+class ReplicaRouter:
+    """
+    Reads go to the "replica" connection, writes to "default". A request reads the primary after
+    its own write, inside a transaction and while the client holds the read_primary cookie
+    """
+
+    def db_for_read(self, model) -> str:
+        state = _primary_reads.get()
+        if state is not None and (state["pinned"] or state["wrote"]):
+            return "default"
+        try:
+            if isinstance(connections.get("default"), BaseTransactionWrapper):
+                return "default"
+        except ConfigurationError:
+            pass
+        return "replica"
+
+    def db_for_write(self, model) -> str:
+        mark_written()
+        return "default"
+
+
+class ReadYourWritesMiddleware:
+    """
+    Tracks writes of the request for ReplicaRouter and pins the client to the primary for
+    sticky_seconds after a write, so replica lag can't hide it on the next request
+    """
+
+    def __init__(self, app, sticky_seconds: int = 5):
+        self.app = app
+        self.sticky_seconds = sticky_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = {"pinned": self._has_cookie(scope), "wrote": False}
+        token = _primary_reads.set(state)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and state["wrote"] and self.sticky_seconds:
+                cookie = f"{PRIMARY_COOKIE}=1; Max-Age={self.sticky_seconds}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _primary_reads.reset(token)
+
+    @staticmethod
+    def _has_cookie(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                return PRIMARY_COOKIE in SimpleCookie(value.decode("latin-1"))
+        return False
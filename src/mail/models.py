@@ -0,0 +1,24 @@
+from tortoise import fields, models
+
+
+class EmailJob(models.Model):
+    """
+    Email waiting to be sent by the mail worker, the table keeps pending jobs across restarts
+    """
+    id = fields.IntField(pk=True)
+    recipients = fields.JSONField()
+    subject = fields.CharField(max_length=255)
+    body = fields.TextField()
+    subtype = fields.CharField(max_length=10, default="html")
+    # pending, sending, sent or failed
+    status = fields.CharField(max_length=10, default="pending")
+    attempts = fields.IntField(default=0)
+    last_error = fields.TextField(null=True)
+    run_at = fields.DatetimeField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+    sent_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "email_job"
+        ordering = ["id"]
+        indexes = (("status", "run_at"), )
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import List, Optional
+
+import aiosmtplib
+
+from src import config
+from src.db import write_transaction
+from src.mail.models import EmailJob
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_email(recipients: List[str], subject: str, body: str, subtype: str = "html") -> EmailJob:
+    """Store the email for the worker and wake it up, nothing is sent on the request path"""
+    job = await EmailJob.create(recipients=recipients, subject=subject, body=body, subtype=subtype,
+                                run_at=datetime.now(timezone.utc))
+    mail_worker.wake()
+    return job
+
+
+def build_message(job: EmailJob) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = config.EMAIL_HOST_USER
+    message["To"] = ", ".join(job.recipients)
+    message["Subject"] = job.subject
+    message.set_content(job.body, subtype=job.subtype)
+    return message
+
+
+class SMTPConnection:
+    """
+    One SMTP session reused for every message of a batch and for the next batches while the queue is busy
+    """
+
+    def __init__(self):
+        self.client: Optional[aiosmtplib.SMTP] = None
+
+    async def send(self, message: EmailMessage) -> None:
+        if self.client is None or not self.client.is_connected:
+            self.client = aiosmtplib.SMTP(hostname=config.EMAIL_HOST, port=config.EMAIL_PORT,
+                                          username=config.EMAIL_HOST_USER or None,
+                                          password=config.EMAIL_HOST_PASSWORD or None,
+                                          use_tls=config.EMAIL_USE_TLS, timeout=config.EMAIL_TIMEOUT)
+            await self.client.connect()
+        await self.client.send_message(message)
+
+    async def close(self) -> None:
+        if self.client is not None and self.client.is_connected:
+            try:
+                await self.client.quit()
+            except aiosmtplib.SMTPException:
+                self.client.close()
+        self.client = None
+
+
+async def claim_jobs(limit: int) -> List[EmailJob]:
+    """
+    Take due jobs and push their run_at by MAIL_LOCK_SECONDS so no other worker takes them,
+    a job of a worker that died becomes due again after that
+    """
+    now = datetime.now(timezone.utc)
+    async with write_transaction() as conn:
+        jobs = await EmailJob.filter(status__in=("pending", "sending"), run_at__lte=now).order_by("run_at") \
+            .limit(limit).select_for_update(skip_locked=True).using_db(conn)
+        if jobs:
+            await EmailJob.filter(id__in=[job.id for job in jobs]).using_db(conn) \
+                .update(status="sending", run_at=now + timedelta(seconds=config.MAIL_LOCK_SECONDS))
+    return jobs
+
+
+async def _finish(job: EmailJob, error: Optional[Exception]) -> None:
+    job.attempts += 1
+    if error is None:
+        job.status, job.sent_at, job.last_error = "sent", datetime.now(timezone.utc), None
+    elif job.attempts >= config.MAIL_MAX_ATTEMPTS:
+        job.status, job.last_error = "failed", str(error)
+        logger.error("email %s to %s failed after %s attempts: %s", job.id, job.recipients, job.attempts, error)
+    else:
+        delay = config.MAIL_RETRY_SECONDS * 2 ** (job.attempts - 1)
+        job.status, job.last_error = "pending", str(error)
+        job.run_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        logger.warning("email %s to %s failed, retry in %s s: %s", job.id, job.recipients, delay, error)
+    await job.save(update_fields=["status", "attempts", "last_error", "run_at", "sent_at"])
+
+
+async def send_due_emails(connection: SMTPConnection, limit: Optional[int] = None) -> int:
+    """
+    Send up to a batch of due jobs over the connection, returns the number of jobs taken.
+    Jobs are claimed one by one, so a lease only has to outlive a single send of at most EMAIL_TIMEOUT
+    """
+    taken = 0
+    while taken < (limit or config.MAIL_BATCH_SIZE):
+        jobs = await claim_jobs(1)
+        if not jobs:
+            break
+        job = jobs[0]
+        taken += 1
+        try:
+            await connection.send(build_message(job))
+        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as ex:
+            await connection.close()
+            await _finish(job, ex)
+        except Exception as ex:
+            # a message that can't be built counts as a failed attempt instead of coming back forever
+            await _finish(job, ex)
+        else:
+            await _finish(job, None)
+    return taken
+
+
+class MailWorker:
+    """
+    Background task of the app process. It drains the queue while there is work, then waits for
+    enqueue_email or MAIL_POLL_SECONDS, which picks up retries and jobs left by a restart
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.event = asyncio.Event()
+        self.connection = SMTPConnection()
+
+    def wake(self) -> None:
+        self.event.set()
+
+    async def run(self) -> None:
+        while True:
+            self.event.clear()
+            try:
+                while await send_due_emails(self.connection):
+                    pass
+            except Exception:
+                logger.exception("mail worker failed")
+            await self.connection.close()
+            try:
+                await asyncio.wait_for(self.event.wait(), config.MAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if config.MAIL_QUEUE_ENABLED and self.task is None:
+            self.event = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.connection.close()
+
+
+mail_worker = MailWorker()
@@ -4,12 +4,32 @@ from src import config
 from fastapi import FastAPI
 from src.sales.router import router as router_product
 from src.users.router import router as router_user
+from src.analytics.router import router as router_analytics
+from src.monitoring import router as router_monitoring, metrics_router
+from src.db import ReadYourWritesMiddleware
+from src.metrics import MetricsMiddleware, install_query_hook
+from src.profiling import ProfilerMiddleware
+from src.mail.utils import mail_worker
 
 app = FastAPI(title="SALES")
 add_pagination(app)
+if config.DB_REPLICA_URL:
+    app.add_middleware(ReadYourWritesMiddleware, sticky_seconds=config.DB_REPLICA_STICKY_SECONDS)
 
 app.include_router(router_product)
 app.include_router(router_user)
+app.include_router(router_analytics)
+app.include_router(router_monitoring)
+app.add_middleware(ProfilerMiddleware)
+if config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
 
+# stop the mail worker before the database connections are closed
+app.add_event_handler("shutdown", mail_worker.stop)
 
-register_tortoise(app=app, config=config.DATABASE_CONFIG, generate_schemas=True, add_exception_handlers=True)
+register_tortoise(app=app, config=config.DATABASE_CONFIG, generate_schemas=config.GENERATE_SCHEMAS,
+                  add_exception_handlers=True)
+if config.METRICS_ENABLED or config.PROFILE_QUERIES != "off":
+    app.add_event_handler("startup", install_query_hook)
+app.add_event_handler("startup", mail_worker.start)
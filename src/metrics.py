@@ -0,0 +1,171 @@
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from tortoise import connections
+
+from src import config
+from src.cache import cache
+from src.db import pool_stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_METHODS = ("execute_insert", "execute_many", "execute_query", "execute_query_dict", "execute_script")
+
+
+class RequestStats:
+    """
+    Database work of one request. statements is a list of (sql, seconds) when the profiler is on
+    """
+    __slots__ = ("scope", "queries", "db_time", "statements")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements: Optional[List[Tuple[str, float]]] = None
+
+    @property
+    def route(self) -> str:
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+    def record(self, query: str, elapsed: float) -> None:
+        self.queries += 1
+        self.db_time += elapsed
+        if self.statements is not None:
+            self.statements.append((query, elapsed))
+        if elapsed * 1000 >= config.SLOW_QUERY_MS:
+            logger.warning("slow query %.1f ms on %s %s: %s",
+                           elapsed * 1000, self.scope["method"], self.route, query)
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+_in_query: ContextVar[bool] = ContextVar("in_query", default=False)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    Per process metrics, the hot path is a dict lookup and a few additions
+    """
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str, int], Histogram] = {}
+        self.db_queries: Dict[Tuple[str, str], int] = {}
+        self.db_seconds: Dict[Tuple[str, str], float] = {}
+
+    def observe(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats) -> None:
+        key = (method, route, status)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.observe(elapsed)
+        self.db_queries[method, route] = self.db_queries.get((method, route), 0) + stats.queries
+        self.db_seconds[method, route] = self.db_seconds.get((method, route), 0.0) + stats.db_time
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route template and status",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route, status), histogram in sorted(self.latency.items()):
+            labels = f'method="{method}",route="{route}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {histogram.count}")
+        lines += ["# HELP http_db_queries_total Database queries issued by route",
+                  "# TYPE http_db_queries_total counter"]
+        lines += [f'http_db_queries_total{{method="{method}",route="{route}"}} {value}'
+                  for (method, route), value in sorted(self.db_queries.items())]
+        lines += ["# HELP http_db_seconds_total Time spent in database queries by route",
+                  "# TYPE http_db_seconds_total counter"]
+        lines += [f'http_db_seconds_total{{method="{method}",route="{route}"}} {value}'
+                  for (method, route), value in sorted(self.db_seconds.items())]
+        lines += ["# HELP cache_requests_total Cache lookups by result", "# TYPE cache_requests_total counter",
+                  f'cache_requests_total{{result="hit"}} {cache.hits}',
+                  f'cache_requests_total{{result="miss"}} {cache.misses}']
+        lines += ["# HELP db_pool_connections Database pool connections by state",
+                  "# TYPE db_pool_connections gauge"]
+        for name, stats in pool_stats().items():
+            for state in ("in_use", "idle", "waiters"):
+                lines.append(f'db_pool_connections{{connection="{name}",state="{state}"}} {stats[state]}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        stats = _request_stats.get()
+        if stats is None or _in_query.get():
+            return await method(self, query, *args, **kwargs)
+        token = _in_query.set(True)
+        started = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            _in_query.reset(token)
+            stats.record(query, time.perf_counter() - started)
+
+    wrapper.query_hook = True
+    return wrapper
+
+
+def install_query_hook() -> None:
+    """Wrap query methods of the connection classes in use, run after Tortoise is initialized"""
+    for conn in connections.all():
+        for cls in (type(conn), *type(conn).__subclasses__()):
+            for name in QUERY_METHODS:
+                method = cls.__dict__.get(name)
+                if method is not None and not getattr(method, "query_hook", False):
+                    setattr(cls, name, _timed(method))
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status: List[int] = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_stats.reset(token)
+            registry.observe(scope["method"], stats.route, status[0], time.perf_counter() - started, stats)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+
+from src.db import pool_stats
+from src.metrics import registry
+from src.users.models import User
+from src.users.utils import get_current_user
+
+router = APIRouter(
+    prefix="/monitoring",
+    tags=["Monitoring"]
+)
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/pool", summary="Database pool usage for Staff User")
+async def get_pool_stats(current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        return pool_stats()
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
@@ -0,0 +1,142 @@
+import base64
+import json
+from math import ceil
+from typing import Generic, List, Optional, Sequence, Tuple, Type, TypeVar
+
+from fastapi_pagination.api import create_page
+from fastapi_pagination import Params
+from fastapi_pagination.bases import AbstractParams
+from fastapi_pagination.ext.utils import generic_query_apply_params
+from fastapi_pagination.utils import verify_params
+from pydantic import BaseModel
+from starlette.exceptions import HTTPException
+from tortoise.expressions import Q
+from tortoise.contrib.pydantic import PydanticModel
+from tortoise.queryset import QuerySet
+
+from src import config
+from src.cache import cache
+
+T = TypeVar("T")
+
+
+async def cached_count(query: QuerySet, key: Optional[str] = None) -> int:
+    """COUNT(*) for the query, memoized in the shared cache for COUNT_CACHE_TTL seconds under key"""
+    if key is None:
+        return await query.count()
+    total = await cache.get(key)
+    if total is None:
+        total = await query.count()
+        await cache.set(key, total, config.COUNT_CACHE_TTL)
+    return total
+
+
+async def paginate_queryset(query: QuerySet,
+                            schema: Type[PydanticModel],
+                            params: Optional[AbstractParams] = None,
+                            count_key: Optional[str] = None,
+                            total: Optional[int] = None):
+    """
+    Page of the queryset with LIMIT/OFFSET and COUNT done by the database,
+    a known total skips the COUNT query
+    """
+    params, raw_params = verify_params(params, "limit-offset")
+    if total is None and raw_params.include_total:
+        total = await cached_count(query, count_key)
+    items = await schema.from_queryset(generic_query_apply_params(query, raw_params))
+    return create_page(items, total=total, params=params)
+
+
+def raw_page(items: list, total: Optional[int], params: Params) -> dict:
+    """Page as a plain dict with the fields and numbers of fastapi_pagination Page"""
+    size = params.size if params.size is not None else (total or None)
+    if size in (0, None):
+        pages = 0
+    elif total is not None:
+        pages = ceil(total / size)
+    else:
+        pages = None
+    return {"items": items, "total": total, "page": params.page or 1, "size": size, "pages": pages}
+
+
+async def paginate_values(query: QuerySet,
+                          fields: Sequence[str],
+                          params: Optional[Params] = None,
+                          count_key: Optional[str] = None,
+                          total: Optional[int] = None) -> dict:
+    """
+    Same page as paginate_queryset made of .values() rows, no model instances and no validation
+    """
+    params, raw_params = verify_params(params, "limit-offset")
+    if total is None and raw_params.include_total:
+        total = await cached_count(query, count_key)
+    items = await generic_query_apply_params(query, raw_params).values(*fields)
+    return raw_page(items, total, params)
+
+
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def encode_cursor(values: Sequence, backward: bool = False) -> str:
+    raw = json.dumps({"k": list(values), "b": backward}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[list, bool]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return list(data["k"]), bool(data["b"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _matches_field(query: QuerySet, key: str, value) -> bool:
+    """Cursor value has the python type of the key field, a forged cursor never reaches the database"""
+    field_type = query.model._meta.fields_map[key].field_type
+    return isinstance(value, field_type) and not (isinstance(value, bool) and field_type is not bool)
+
+
+def _seek_filter(keys: Sequence[str], values: Sequence, backward: bool) -> Q:
+    """(k1, k2, ...) > (v1, v2, ...) written out as OR of prefix equalities"""
+    op = "lt" if backward else "gt"
+    condition = None
+    for i, key in enumerate(keys):
+        term = Q(**{k: v for k, v in zip(keys[:i], values[:i])}, **{f"{key}__{op}": values[i]})
+        condition = term if condition is None else condition | term
+    return condition
+
+
+async def paginate_keyset(query: QuerySet,
+                          keys: Sequence[str],
+                          cursor: Optional[str] = None,
+                          size: int = 50) -> Tuple[list, Optional[str], Optional[str]]:
+    """
+    Seek pagination over unique ordering keys, every page costs one indexed range scan.
+    Returns (items, next_cursor, prev_cursor)
+    """
+    backward = False
+    if cursor:
+        values, backward = decode_cursor(cursor)
+        if len(values) != len(keys) or not all(_matches_field(query, key, value) for key, value in zip(keys, values)):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(_seek_filter(keys, values, backward))
+    ordering = [f"-{key}" for key in keys] if backward else list(keys)
+    items = list(await query.order_by(*ordering).limit(size + 1))
+    has_more = len(items) > size
+    items = items[:size]
+    if backward:
+        items.reverse()
+    if not items:
+        return items, None, None
+
+    def key_of(obj):
+        return [getattr(obj, key) for key in keys]
+
+    next_cursor = encode_cursor(key_of(items[-1])) if (has_more or backward) else None
+    prev_cursor = encode_cursor(key_of(items[0]), backward=True) if (cursor and not backward) or \
+        (backward and has_more) else None
+    return items, next_cursor, prev_cursor
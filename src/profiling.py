@@ -0,0 +1,84 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from typing import List, Tuple
+
+from src import config
+from src.metrics import RequestStats, _request_stats, current_stats
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile-queries"
+SUMMARY_HEADER = b"x-query-profile"
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|\?|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+
+def query_shape(sql: str) -> str:
+    """SQL with literals and parameters replaced by ?, so repeated lookups of different rows compare equal"""
+    shape = _LITERALS.sub("?", sql)
+    return " ".join(_LISTS.sub("(?)", shape).split())
+
+
+def summarize(statements: List[Tuple[str, float]]) -> dict:
+    shapes = Counter(query_shape(sql) for sql, _ in statements)
+    return {
+        "queries": len(statements),
+        "db_ms": round(sum(elapsed for _, elapsed in statements) * 1000, 2),
+        "repeated": [{"shape": shape, "count": count} for shape, count in shapes.most_common()
+                     if count >= config.N_PLUS_ONE_THRESHOLD],
+        "statements": [{"sql": sql, "ms": round(elapsed * 1000, 2)} for sql, elapsed in statements],
+    }
+
+
+def _requested(scope) -> bool:
+    if config.PROFILE_QUERIES == "on":
+        return True
+    if config.PROFILE_QUERIES == "header":
+        return any(name == PROFILE_HEADER and value in (b"1", b"true") for name, value in scope["headers"])
+    return False
+
+
+class ProfilerMiddleware:
+    """
+    Collects the SQL of a request when PROFILE_QUERIES is "on", or "header" and the client sent
+    X-Profile-Queries: 1. The totals and repeated query shapes go to the X-Query-Profile header,
+    the full profile is logged as JSON
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            return await self.app(scope, receive, send)
+        stats = current_stats()
+        token = None
+        if stats is None:
+            stats = RequestStats(scope)
+            token = _request_stats.set(stats)
+        stats.statements = []
+        started = time.perf_counter()
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                summary = summarize(stats.statements)
+                value = f"queries={summary['queries']}; db_ms={summary['db_ms']}; repeated={len(summary['repeated'])}"
+                message["headers"] = [*message.get("headers", []), (SUMMARY_HEADER, value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if token is not None:
+                _request_stats.reset(token)
+            summary = summarize(stats.statements)
+            summary.update(method=scope["method"], route=stats.route,
+                           elapsed_ms=round((time.perf_counter() - started) * 1000, 2))
+            if summary["repeated"]:
+                logger.warning("possible N+1 on %s %s: %s", scope["method"], stats.route,
+                               json.dumps(summary["repeated"]))
+            logger.info(json.dumps(summary))
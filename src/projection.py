@@ -0,0 +1,35 @@
+import functools
+from typing import Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter, create_model
+from starlette.exceptions import HTTPException
+
+
+def parse_fields(fields: Optional[str], schema: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    fields=id,name as a tuple in the schema order, None when all fields are wanted. Unknown names are a 400
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {sorted(unknown)}, "
+                                                    f"allowed {list(schema.model_fields)}")
+    return tuple(name for name in schema.model_fields if name in requested)
+
+
+@functools.lru_cache(maxsize=256)
+def subset_adapter(schema: Type[BaseModel], fields: Tuple[str, ...]) -> TypeAdapter:
+    """Validator of a list of the schema restricted to fields, built once per combination"""
+    model = create_model(f"{schema.__name__}[{','.join(fields)}]",
+                         **{name: (schema.model_fields[name].annotation, schema.model_fields[name])
+                            for name in fields})
+    return TypeAdapter(List[model])
+
+
+def validate_subset(rows: Iterable[dict], schema: Type[BaseModel], fields: Tuple[str, ...]) -> list:
+    """Rows checked against the requested subset of the schema and returned as plain dicts"""
+    adapter = subset_adapter(schema, fields)
+    return adapter.dump_python(adapter.validate_python([{name: row[name] for name in fields} for row in rows]),
+                               mode="json")
@@ -0,0 +1,29 @@
+from typing import Any
+
+from pydantic_core import to_json, to_jsonable_python
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """
+    JSON bytes in native code, orjson when it is installed and pydantic-core otherwise.
+    Datetimes, dates and pydantic models are written the same way pydantic does
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=to_jsonable_python, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return to_json(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Returned from an endpoint it also skips the response_model validation and jsonable_encoder of FastAPI,
+    so the content must already have the declared shape
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,7 +1,13 @@
 from tortoise import fields, models
+from tortoise.indexes import PartialIndex
 from tortoise.contrib.pydantic import pydantic_model_creator, pydantic_queryset_creator
 
 
+class SafePartialIndex(PartialIndex):
+    """PartialIndex created with IF NOT EXISTS, so generate_schemas can run against an existing schema"""
+    INDEX_CREATE_TEMPLATE = "CREATE{index_type}INDEX {exists}{index_name} ON {table_name} ({fields}){extra};"
+
+
 class Product(models.Model):
     """
     The Product model
@@ -16,6 +22,8 @@ class Product(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = (SafePartialIndex(fields=("name", ), name="idx_product_name_active",
+                                    condition={"is_active": True}), )
 
     class PydanticMeta:
         exclude = ["products_in_deal", ]
@@ -30,17 +38,40 @@ class Deal(models.Model):
     product = fields.ForeignKeyField("sales.Product", related_name="products_in_deal")
     count = fields.IntField()
     price = fields.IntField()
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
 
     class Meta:
         ordering = ["id"]
+        indexes = (("user_id", "id"), ("product_id", ))
 
     class PydanticMeta:
         pass
 
 
+class BasketSummary(models.Model):
+    """
+    Count and price of the user's basket, changed together with Deal rows
+    """
+    id = fields.IntField(pk=True)
+    user = fields.OneToOneField("users.User", on_delete=fields.CASCADE, related_name="basket_summary")
+    count = fields.IntField(default=0)
+    total = fields.IntField(default=0)
+
+
 Product_Pydantic = pydantic_model_creator(Product)
-ProductIn_Pydantic = pydantic_model_creator(Product, exclude_readonly=False)
-Product_List_Pydantic = pydantic_queryset_creator(Product)
-Deal_Pydantic = pydantic_model_creator(Deal)
-DealIn_Pydantic = pydantic_model_creator(Deal, exclude_readonly=True)
-DealListPydantic = pydantic_queryset_creator(Deal)
+
+# not used by the routers, built on first import
+_LAZY_MODELS = {
+    "ProductIn_Pydantic": lambda: pydantic_model_creator(Product, exclude_readonly=False),
+    "Product_List_Pydantic": lambda: pydantic_queryset_creator(Product),
+    "Deal_Pydantic": lambda: pydantic_model_creator(Deal),
+    "DealIn_Pydantic": lambda: pydantic_model_creator(Deal, exclude_readonly=True),
+    "DealListPydantic": lambda: pydantic_queryset_creator(Deal),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_MODELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    model = globals()[name] = _LAZY_MODELS[name]()
+    return model
@@ -1,26 +1,128 @@
 
-from fastapi import APIRouter, Depends
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response
 
 from src.sales.models import Product_Pydantic, Product, Deal
-from src.sales.schemas import ProductIn, DealOut
+from src.sales.schemas import ProductIn, ProductAll, DealOut, BulkImportResult, CheckoutItem, CheckoutOut, \
+    CheckoutLine, BasketSummaryOut
 from starlette.exceptions import HTTPException
-from fastapi_pagination import Page, paginate
+from tortoise.functions import Count, Max
+from fastapi_pagination import Page
+from fastapi_pagination.api import resolve_params
+from pydantic_core import to_jsonable_python
 
 from src.users.models import User
-from src.users.utils import get_current_user
-from src.sales.utils import total_func
+from src.users.schemas import UserAll
+from src.users.utils import get_current_user, get_token_user
+from src import config
+from src.db import write_transaction
+from src.cache import cache
+from src.conditional import make_etag, conditional_response, to_datetime, cache_headers
+from src.sales.utils import product_key, product_list_key, invalidate_products, import_products, \
+    add_to_basket_summary, get_basket_summary, reconcile_basket_summaries
+from src.streaming import iter_csv, iter_ndjson, export_response
+from src.pagination import paginate_queryset, paginate_keyset, paginate_values, CursorPage
+from src.projection import parse_fields, validate_subset
+from src.responses import FastJSONResponse
 
 router = APIRouter(
     prefix="/product",
     tags=["Product"]
 )
 
+PRODUCT_FIELDS = tuple(Product_Pydantic.model_fields)
+
 
 @router.get("/product_list", summary="List of Products for Authorized User")
-async def get_products(current_user: User = Depends(get_current_user)) -> Page[Product_Pydantic]:
+async def get_products(request: Request, response: Response,
+                       fields: Optional[str] = Query(None, description="Comma separated subset, e.g. id,name,price"),
+                       current_user: User = Depends(get_token_user)) -> Page[Product_Pydantic]:
+    if current_user:
+        params = resolve_params()
+        selected = parse_fields(fields, Product_Pydantic)
+        key = f"{await product_list_key()}:{params.page}:{params.size}:{','.join(selected or ())}"
+        cached = await cache.get(key)
+        if cached is None:
+            query = Product.filter(is_active=True)
+            meta = await query.annotate(total=Count("id"), last_modified=Max("updated_at")) \
+                .first().values("total", "last_modified")
+            etag = make_etag("product_list", params.page, params.size, selected, meta["total"], meta["last_modified"])
+            last_modified = to_datetime(meta["last_modified"])
+            not_modified = conditional_response(request, response, etag, last_modified)
+            if not_modified:
+                return not_modified
+            page = await paginate_values(query, selected or PRODUCT_FIELDS, params, total=meta["total"])
+            if selected:
+                page["items"] = validate_subset(page["items"], Product_Pydantic, selected)
+            page = to_jsonable_python(page)
+            await cache.set(key, {"etag": etag,
+                                  "last_modified": last_modified and last_modified.isoformat(),
+                                  "page": page}, config.PRODUCT_CACHE_TTL)
+            return FastJSONResponse(page, headers=cache_headers(etag, last_modified))
+        last_modified = to_datetime(cached["last_modified"])
+        not_modified = conditional_response(request, response, cached["etag"], last_modified)
+        return not_modified or FastJSONResponse(cached["page"], headers=cache_headers(cached["etag"], last_modified))
+    else:
+        raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
+
+
+@router.get("/product_cursor", summary="Cursor paged List of Products for Authorized User")
+async def get_products_cursor(cursor: Optional[str] = None, size: int = Query(50, ge=1, le=100),
+                              current_user: User = Depends(get_token_user)) -> CursorPage[Product_Pydantic]:
+    if current_user:
+        items, next_cursor, prev_cursor = await paginate_keyset(
+            Product.filter(is_active=True), ("name", "id"), cursor, size)
+        return CursorPage[Product_Pydantic](
+            items=[Product_Pydantic.model_validate(p) for p in items],
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor)
+    else:
+        raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
+
+
+@router.get("/deal_cursor", summary="Cursor paged basket for User")
+async def get_basket_cursor(cursor: Optional[str] = None, size: int = Query(50, ge=1, le=100),
+                            current_user: User = Depends(get_current_user)) -> CursorPage[DealOut]:
+    if current_user:
+        items, next_cursor, prev_cursor = await paginate_keyset(
+            Deal.filter(user_id=current_user.id).select_related("product"), ("id", ), cursor, size)
+        basket = []
+        for b in items:
+            deal_ = {
+                "id": b.id,
+                "user": current_user,
+                "product": b.product,
+                "count": b.count,
+                "price": b.price}
+            basket.append(DealOut.model_validate(deal_))
+        return CursorPage[DealOut](items=basket, next_cursor=next_cursor, prev_cursor=prev_cursor)
+    else:
+        raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
+
+
+@router.get("/search", summary="Search Products by name and price for Authorized User")
+async def search_products(q: Optional[str] = Query(None, min_length=1), prefix: bool = False,
+                          min_price: Optional[int] = None, max_price: Optional[int] = None,
+                          is_active: Optional[bool] = True,
+                          fields: Optional[str] = Query(None, description="Comma separated subset, e.g. id,name,price"),
+                          current_user: User = Depends(get_token_user)) -> Page[Product_Pydantic]:
     if current_user:
-        prod = await Product_Pydantic.from_queryset(Product.filter(is_active=True))
-        return paginate(prod, safe=True)
+        query = Product.all()
+        if q:
+            query = query.filter(name__istartswith=q) if prefix else query.filter(name__icontains=q)
+        if min_price is not None:
+            query = query.filter(price__gte=min_price)
+        if max_price is not None:
+            query = query.filter(price__lte=max_price)
+        if is_active is not None:
+            query = query.filter(is_active=is_active)
+        selected = parse_fields(fields, Product_Pydantic)
+        if selected:
+            page = await paginate_values(query, selected)
+            page["items"] = validate_subset(page["items"], Product_Pydantic, selected)
+            return FastJSONResponse(page)
+        return await paginate_queryset(query, Product_Pydantic)
     else:
         raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
 
@@ -33,19 +135,104 @@ async def create_product(product: ProductIn, current_user: User = Depends(get_cu
             raise HTTPException(status_code=404, detail=f"{product.name} has already exist")
         else:
             obj = await Product.create(**product.model_dump(exclude_unset=True))
+            await invalidate_products()
             return await Product_Pydantic.from_tortoise_orm(obj)
     else:
         raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
 
 
+@router.post("/bulk_import", summary="Create or update Products from NDJSON or CSV body for Staff User",
+             response_model=BulkImportResult)
+async def bulk_import_products(request: Request, upsert: bool = True, current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        if request.headers.get("content-type", "").startswith("text/csv"):
+            rows = iter_csv(request.stream())
+        else:
+            rows = iter_ndjson(request.stream())
+        return await import_products(rows, upsert, config.BULK_CHUNK_SIZE)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.post("/checkout", summary="Create deals for several Products at once for User", response_model=CheckoutOut)
+async def checkout(items: List[CheckoutItem], current_user: User = Depends(get_current_user)):
+    if not items:
+        raise HTTPException(status_code=400, detail="Basket is empty")
+    counts = {}
+    for item in items:
+        counts[item.product_id] = counts.get(item.product_id, 0) + item.count
+    products = {prod.id: prod for prod in await Product.filter(id__in=list(counts))}
+    missing = [p_id for p_id in counts if p_id not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products {missing} not found")
+    inactive = [p_id for p_id, prod in products.items() if not prod.is_active]
+    if inactive:
+        raise HTTPException(status_code=400, detail=f"Products {inactive} aren't active")
+    deals = [Deal(user_id=current_user.id, product=products[p_id], count=count, price=products[p_id].price * count)
+             for p_id, count in counts.items()]
+    async with write_transaction() as conn:
+        await Deal.bulk_create(deals, using_db=conn)
+        await add_to_basket_summary(conn, current_user.id, sum(counts.values()), sum(deal.price for deal in deals))
+    return CheckoutOut(items=[CheckoutLine.model_validate(deal) for deal in deals],
+                       total=sum(deal.price for deal in deals))
+
+
+@router.get("/basket_summary", summary="Count and total of the basket for User", response_model=BasketSummaryOut)
+async def basket_summary(current_user: User = Depends(get_current_user)):
+    if current_user:
+        return await get_basket_summary(current_user.id)
+    else:
+        raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
+
+
+@router.post("/basket_reconcile", summary="Recount basket summaries from deals for Staff User")
+async def basket_reconcile(current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        return {"repaired": await reconcile_basket_summaries()}
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.get("/product_export", summary="Export Products as NDJSON or CSV stream for Staff User")
+async def export_products(fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                          current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        fields = ("id", "name", "price", "photo", "created_at", "updated_at", "is_active")
+        return export_response(Product.all(), fields, fmt, "products", config.EXPORT_CHUNK_SIZE)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
+@router.get("/deal_export", summary="Export Deals as NDJSON or CSV stream for Staff User")
+async def export_deals(fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                       current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        fields = ("id", "user_id", "product_id", "count", "price", "created_at")
+        return export_response(Deal.all(), fields, fmt, "deals", config.EXPORT_CHUNK_SIZE)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
+
+
 @router.get("/{p_id}", summary="Get Product for Authorized User", response_model=Product_Pydantic)
-async def get_product(p_id: int, current_user: User = Depends(get_current_user)):
+async def get_product(p_id: int, request: Request, response: Response,
+                      fields: Optional[str] = Query(None, description="Comma separated subset, e.g. id,name,price"),
+                      current_user: User = Depends(get_token_user)):
     if current_user:
-        prod = await Product.filter(id=p_id).first()
-        if prod:
-            return await Product_Pydantic.from_tortoise_orm(prod)
-        else:
-            raise HTTPException(status_code=404, detail=f"Product {p_id} don't found")
+        prod = await cache.get(product_key(p_id))
+        if prod is None:
+            obj = await Product.filter(id=p_id).first()
+            if not obj:
+                raise HTTPException(status_code=404, detail=f"Product {p_id} don't found")
+            prod = (await Product_Pydantic.from_tortoise_orm(obj)).model_dump(mode="json")
+            await cache.set(product_key(p_id), prod, config.PRODUCT_CACHE_TTL)
+        selected = parse_fields(fields, Product_Pydantic)
+        if selected:
+            etag = make_etag("product", prod["id"], prod["updated_at"], selected)
+            last_modified = to_datetime(prod["updated_at"])
+            return conditional_response(request, response, etag, last_modified) or FastJSONResponse(
+                validate_subset([prod], Product_Pydantic, selected)[0], headers=cache_headers(etag, last_modified))
+        etag = make_etag("product", prod["id"], prod["updated_at"])
+        return conditional_response(request, response, etag, to_datetime(prod["updated_at"])) or prod
     else:
         raise HTTPException(status_code=401, detail=f"{current_user.email} is unauthorized user")
 
@@ -55,7 +242,8 @@ async def update_product(p_id: int, product: ProductIn, current_user: User = Dep
     if current_user.is_staff:
         prod = await Product.filter(id=p_id).first()
         if prod:
-            await Product.filter(id=p_id).update(**product.model_dump(exclude_unset=True))
+            await prod.update_from_dict(product.model_dump(exclude_unset=True)).save()
+            await invalidate_products(p_id)
             return await Product_Pydantic.from_queryset_single(Product.get(id=p_id))
         else:
             raise HTTPException(status_code=404, detail=f"Product {p_id} don't found")
@@ -73,6 +261,7 @@ async def product_is_active(p_id: int, current_user: User = Depends(get_current_
             else:
                 prod.is_active = True
             await prod.save()
+            await invalidate_products(p_id)
             return await Product_Pydantic.from_queryset_single(Product.get(id=p_id))
         else:
             raise HTTPException(status_code=404, detail=f"Product {p_id} isn't found")
@@ -83,9 +272,17 @@ async def product_is_active(p_id: int, current_user: User = Depends(get_current_
 @router.delete("/{p_id}", summary="Delete Product for Staff User")
 async def delete_product(p_id: int, current_user: User = Depends(get_current_user)):
     if current_user.is_staff:
-        deleted_count = await Product.filter(id=p_id).delete()
-        if not deleted_count:
-            raise HTTPException(status_code=404, detail=f"Product {p_id} not found")
+        async with write_transaction() as conn:
+            # the row lock makes deals created for the product wait until it is gone
+            if not await Product.filter(id=p_id).select_for_update().using_db(conn).values_list("id", flat=True):
+                raise HTTPException(status_code=404, detail=f"Product {p_id} not found")
+            user_ids = await Deal.filter(product_id=p_id).group_by("user_id").order_by("user_id") \
+                .using_db(conn).values_list("user_id", flat=True)
+            await Product.filter(id=p_id).using_db(conn).delete()
+            if user_ids:
+                # deals of the product are removed by cascade
+                await reconcile_basket_summaries(list(user_ids), conn)
+        await invalidate_products(p_id)
         raise HTTPException(status_code=200, detail=f"Product {p_id} was deleted ")
     else:
         raise HTTPException(status_code=403, detail=f"{current_user.email} isn't staff user")
@@ -98,13 +295,12 @@ async def add_product_to_deal(product_id: int, count_product: int, current_user:
     if current_user:
         prod = await Product.filter(id=product_id).first()
         if prod:
-            deal_ = {
-                "user": current_user,
-                "product": prod,
-                "count": count_product,
-                "price": prod.price * count_product}
-            obj = await Deal.create(**deal_)
-            return DealOut.from_orm(obj)
+            async with write_transaction() as conn:
+                obj = await Deal.create(user_id=current_user.id, product=prod, count=count_product,
+                                        price=prod.price * count_product, using_db=conn)
+                await add_to_basket_summary(conn, current_user.id, obj.count, obj.price)
+            return DealOut(id=obj.id, user=UserAll.model_validate(current_user), product=prod,
+                           count=obj.count, price=obj.price)
         else:
             raise HTTPException(status_code=403, detail=f"Product {product_id} not found")
     else:
@@ -115,21 +311,23 @@ async def add_product_to_deal(product_id: int, count_product: int, current_user:
 async def get_basket(d_id: int, current_user: User = Depends(get_current_user)):
     if current_user:
         if d_id == 0:
-            basket = await Deal.filter(user=current_user)
+            query = Deal.filter(user_id=current_user.id)
         else:
-            basket = await Deal.filter(user=current_user, id=d_id)
+            query = Deal.filter(user_id=current_user.id, id=d_id)
+        basket = await query.values("id", "count", "price", *(f"product__{f}" for f in ProductAll.model_fields))
         if basket:
-            total = total_func(basket)
+            total = (await get_basket_summary(current_user.id)).total if d_id == 0 else basket[0]["price"]
+            user = UserAll.model_validate(current_user).model_dump()
             basket_all = []
             for b in basket:
                 deal_ = {
-                    "id": b.id,
-                    "user": await b.user,
-                    "product": await b.product,
-                    "count": b.count,
-                    "price": b.price}
-                basket_all.append(DealOut.from_orm(deal_))
-            return {"basket": basket_all, "total": total}
+                    "id": b["id"],
+                    "user": user,
+                    "product": {f: b[f"product__{f}"] for f in ProductAll.model_fields},
+                    "count": b["count"],
+                    "price": b["price"]}
+                basket_all.append(deal_)
+            return FastJSONResponse({"basket": basket_all, "total": total})
         else:
             raise HTTPException(status_code=404, detail=f"{d_id} don't exist or {current_user.email} basket is empty")
     else:
@@ -139,10 +337,15 @@ async def get_basket(d_id: int, current_user: User = Depends(get_current_user)):
 @router.delete("/deal/{d_id}", summary="Delete basket for User (d_id=0) or deal_id")
 async def delete_basket(d_id: int, current_user: User = Depends(get_current_user)):
     if current_user:
-        if d_id == 0:
-            deleted_item = await Deal.filter(user=current_user).delete()
-        else:
-            deleted_item = await Deal.filter(user=current_user, id=d_id).delete()
+        query = Deal.filter(user_id=current_user.id)
+        if d_id != 0:
+            query = query.filter(id=d_id)
+        async with write_transaction() as conn:
+            rows = await query.select_for_update().using_db(conn).values_list("id", "count", "price")
+            deleted_item = await Deal.filter(id__in=[row[0] for row in rows]).using_db(conn).delete() if rows else 0
+            if deleted_item:
+                await add_to_basket_summary(conn, current_user.id, -sum(row[1] for row in rows),
+                                            -sum(row[2] for row in rows))
         if deleted_item:
             raise HTTPException(status_code=200, detail=f"{current_user.email} deal {d_id or 'all'} was deleted")
         else:
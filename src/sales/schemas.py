@@ -33,3 +33,36 @@ class DealIn(BaseModel):
     product_id: int
     count: int
     price: int
+
+
+class BasketSummaryOut(BaseModel):
+    count: int = 0
+    total: int = 0
+
+
+class CheckoutItem(BaseModel):
+    product_id: int
+    count: conint(gt=0)
+
+
+class CheckoutLine(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    product: ProductAll
+    count: int
+    price: int
+
+
+class CheckoutOut(BaseModel):
+    items: List[CheckoutLine]
+    total: int
+
+
+class RowError(BaseModel):
+    row: int
+    error: str
+
+
+class BulkImportResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    errors: List[RowError] = []
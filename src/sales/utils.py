@@ -1,20 +1,131 @@
-from typing import overload
-from src.sales.models import Deal
+from typing import AsyncIterator, List, Optional, Tuple
 
+from pydantic import ValidationError
+from tortoise import BaseDBAsyncClient
+from tortoise.functions import Sum
 
-@overload
-def total_func(value: Deal) -> int: ...
-@overload
-def total_func(value: list) -> int: ...
+from src.cache import cache
+from src.sales.models import BasketSummary, Deal, Product
+from src.sales.schemas import ProductIn, BulkImportResult, RowError, BasketSummaryOut
+from src.streaming import Row
 
 
-def total_func(value):
-    if isinstance(value, Deal):
-        return value.price
-    elif isinstance(value, list):
-        pr = 0
-        for item in value:
-            pr += item.price
-        return pr
+async def add_to_basket_summary(conn: BaseDBAsyncClient, user_id: int, count: int, total: int) -> None:
+    """
+    Add count and total (negative on delete) to the user's summary with one upsert,
+    call it on the connection of the transaction that writes the deals
+    """
+    if conn.capabilities.dialect == "postgres":
+        params = "$1, $2, $3"
     else:
-        raise TypeError
+        params = "?, ?, ?"
+    await conn.execute_query(
+        f'INSERT INTO "basketsummary" ("user_id", "count", "total") VALUES ({params}) '
+        'ON CONFLICT ("user_id") DO UPDATE SET "count" = "basketsummary"."count" + EXCLUDED."count", '
+        '"total" = "basketsummary"."total" + EXCLUDED."total"',
+        [user_id, count, total])
+
+
+async def reconcile_basket_summaries(user_ids: Optional[List[int]] = None,
+                                     conn: Optional[BaseDBAsyncClient] = None) -> int:
+    """
+    Recount summaries from Deal rows and rewrite the ones that drifted, all users by default.
+    Returns the number of repaired users
+    """
+    deals = Deal.all().using_db(conn)
+    summaries = BasketSummary.all().using_db(conn)
+    if user_ids is not None:
+        deals = deals.filter(user_id__in=user_ids)
+        summaries = summaries.filter(user_id__in=user_ids)
+    actual = {row["user_id"]: (row["units"], row["amount"]) for row in await deals
+              .annotate(units=Sum("count"), amount=Sum("price")).group_by("user_id").order_by("user_id")
+              .values("user_id", "units", "amount")}
+    stored = {row["user_id"]: (row["count"], row["total"]) for row in await summaries
+              .values("user_id", "count", "total")}
+    drifted = [BasketSummary(user_id=user_id, count=count, total=total)
+               for user_id, (count, total) in actual.items() if stored.get(user_id) != (count, total)]
+    empty = [user_id for user_id, value in stored.items() if user_id not in actual and value != (0, 0)]
+    if drifted:
+        await BasketSummary.bulk_create(drifted, on_conflict=["user_id"], update_fields=["count", "total"],
+                                        using_db=conn)
+    if empty:
+        await BasketSummary.filter(user_id__in=empty).using_db(conn).update(count=0, total=0)
+    return len(drifted) + len(empty)
+
+
+async def get_basket_summary(user_id: int) -> BasketSummaryOut:
+    row = await BasketSummary.filter(user_id=user_id).values("count", "total")
+    if not row:
+        await reconcile_basket_summaries([user_id])
+        row = await BasketSummary.filter(user_id=user_id).values("count", "total")
+    return BasketSummaryOut(**row[0]) if row else BasketSummaryOut()
+
+
+PRODUCT_GENERATION_KEY = "product:generation"
+
+
+def product_key(p_id: int) -> str:
+    return f"product:{p_id}"
+
+
+async def product_list_key() -> str:
+    """Prefix of cached product list entries, it changes after every product write"""
+    generation = await cache.get_int(PRODUCT_GENERATION_KEY)
+    return f"product_list:{generation}"
+
+
+async def invalidate_products(*p_ids: int) -> None:
+    await cache.incr(PRODUCT_GENERATION_KEY)
+    await cache.delete(*(product_key(p_id) for p_id in p_ids))
+
+
+async def import_products(rows: AsyncIterator[Row], upsert: bool, chunk_size: int) -> BulkImportResult:
+    """
+    Validate rows with ProductIn and write them with one bulk INSERT per chunk,
+    bad rows are reported and skipped. Cached lists and the cached updated products are invalidated
+    """
+    result = BulkImportResult()
+    updated: List[int] = []
+    chunk: List[Tuple[int, ProductIn]] = []
+    async for number, row, error in rows:
+        if error is None:
+            try:
+                chunk.append((number, ProductIn.model_validate(row)))
+            except ValidationError as ex:
+                error = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in ex.errors())
+        if error is not None:
+            result.errors.append(RowError(row=number, error=error))
+        if len(chunk) >= chunk_size:
+            updated.extend(await _write_products(chunk, upsert, result))
+            chunk = []
+    if chunk:
+        updated.extend(await _write_products(chunk, upsert, result))
+    await invalidate_products(*updated)
+    return result
+
+
+async def _write_products(chunk: List[Tuple[int, ProductIn]], upsert: bool, result: BulkImportResult) -> List[int]:
+    """Write one chunk, returns the ids of the existing products it updated"""
+    by_name = {}
+    for number, item in chunk:
+        if item.name in by_name:
+            result.errors.append(RowError(row=number, error=f"Duplicate name {item.name} in batch"))
+        else:
+            by_name[item.name] = (number, item)
+    try:
+        existing = dict(await Product.filter(name__in=list(by_name)).values_list("name", "id"))
+        if not upsert:
+            for name in existing:
+                result.errors.append(RowError(row=by_name.pop(name)[0], error=f"{name} has already exist"))
+        objects = [Product(**item.model_dump()) for _, item in by_name.values()]
+        if upsert:
+            await Product.bulk_create(objects, on_conflict=["name"], update_fields=["price", "photo", "updated_at"])
+            result.updated += len(existing)
+            result.created += len(objects) - len(existing)
+            return list(existing.values())
+        else:
+            await Product.bulk_create(objects)
+            result.created += len(objects)
+    except Exception as ex:
+        result.errors.extend(RowError(row=number, error=f"Batch failed: {ex}") for number, _ in by_name.values())
+    return []
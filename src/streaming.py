@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from starlette.responses import StreamingResponse
+from tortoise.queryset import QuerySet
+
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def _decode(line: bytes) -> Tuple[str, Optional[str]]:
+    try:
+        return line.decode("utf-8").rstrip("\r"), None
+    except UnicodeDecodeError as ex:
+        return "", f"Invalid UTF-8 at byte {ex.start}"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    (text, decode error) for every line of a streamed utf-8 body, the body is never held in memory as a whole.
+    A line that isn't valid utf-8 comes with an error instead of failing the whole body
+    """
+    tail = b""
+    async for chunk in chunks:
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            yield _decode(line)
+    if tail:
+        yield _decode(tail)
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """(line number, object, parse error) for every non empty line"""
+    number = 0
+    async for line, error in iter_lines(chunks):
+        number += 1
+        if error:
+            yield number, None, error
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as ex:
+            yield number, None, f"Invalid JSON: {ex}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "Expected JSON object"
+            continue
+        yield number, row, None
+
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """(line number, row, parse error) for CSV with a header line, quoted fields must not contain line breaks"""
+    header = None
+    number = 0
+    async for line, error in iter_lines(chunks):
+        number += 1
+        if error:
+            yield number, None, error
+            continue
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield number, dict(zip(header, values)), None
+
+
+async def iter_queryset(query: QuerySet, fields: Sequence[str], chunk_size: int) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Rows of the query fetched in id ordered chunks, memory does not depend on the table size.
+    fields must contain "id"
+    """
+    last_id = None
+    while True:
+        chunk_query = query.order_by("id").limit(chunk_size)
+        if last_id is not None:
+            chunk_query = chunk_query.filter(id__gt=last_id)
+        rows = await chunk_query.values(*fields)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            break
+        last_id = rows[-1]["id"]
+
+
+async def ndjson_lines(rows: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def csv_lines(rows: AsyncIterator[Dict[str, Any]], fields: Sequence[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    async for row in rows:
+        writer.writerow([row[field] for field in fields])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_response(query: QuerySet, fields: Sequence[str], fmt: str, name: str, chunk_size: int) \
+        -> StreamingResponse:
+    rows = iter_queryset(query, fields, chunk_size)
+    if fmt == "csv":
+        body, media_type = csv_lines(rows, fields), "text/csv"
+    else:
+        body, media_type = ndjson_lines(rows), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
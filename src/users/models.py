@@ -15,14 +15,26 @@ class User(models.Model):
     is_verified = fields.BooleanField(default=False)
     is_staff = fields.BooleanField(default=False)
     is_superuser = fields.BooleanField(default=False)
+    token_version = fields.IntField(default=0)
 
     class Meta:
         ordering = ["id"]
 
     class PydanticMeta:
-        exclude = ["hashed_password", ]
+        exclude = ["hashed_password", "token_version", ]
 
 
 UserPydantic = pydantic_model_creator(User)
-UserPydanticFull = pydantic_model_creator(User, exclude_readonly=True)
-UserListPydantic = pydantic_queryset_creator(User, include=("id", ))
+
+# not used by the routers, built on first import
+_LAZY_MODELS = {
+    "UserPydanticFull": lambda: pydantic_model_creator(User, exclude_readonly=True),
+    "UserListPydantic": lambda: pydantic_queryset_creator(User, include=("id", )),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_MODELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    model = globals()[name] = _LAZY_MODELS[name]()
+    return model
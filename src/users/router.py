@@ -1,12 +1,18 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi_mail import MessageSchema, MessageType
+from src.mail.utils import enqueue_email
 from src.users.models import User, UserPydantic
 from starlette.exceptions import HTTPException
 from src.users.schemas import UserAuth, TokenSchema, UserToken, UserUpdate
-from fastapi import Depends, HTTPException, status, APIRouter
-from src.users.utils import get_user_by_email_or_phone, get_hashed_password, create_access_token, verify_password, \
-    get_current_user, get_user_verify, create_jwt_for_verify_email
+from fastapi import Depends, HTTPException, status, APIRouter, Query
+from src import config
+from src.streaming import export_response
+from src.projection import parse_fields, validate_subset
+from src.responses import FastJSONResponse
+from src.users.utils import get_user_by_email_or_phone, hash_password, create_access_token, check_password, \
+    get_current_user, get_user_verify, create_jwt_for_verify_email, invalidate_user, \
+    revoke_tokens
+from src.cache import cache
 
 router = APIRouter(
     prefix="/users",
@@ -27,12 +33,13 @@ async def create_user(data: UserAuth):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this email already exist"
         )
+    hashed_password = await hash_password(data.password)
     try:
         user_obj = await User.create(
              full_name=data.full_name,
              email=data.email,
              phone=data.phone,
-             hashed_password=get_hashed_password(data.password),
+             hashed_password=hashed_password,
          )
     except Exception as e:
         raise HTTPException(
@@ -50,12 +57,17 @@ async def login_token(form_data: UserToken):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect email or phone"
         )
-    if not verify_password(form_data.password, user.hashed_password):
+    is_valid, new_hash = await check_password(form_data.password, user.hashed_password)
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect password"
         )
-    return TokenSchema(access_token=create_access_token(user.email), token_type="Bearer")
+    if new_hash:
+        user.hashed_password = new_hash
+        await user.save(update_fields=["hashed_password"])
+        await invalidate_user(user.email)
+    return TokenSchema(access_token=create_access_token(user.email, user=user), token_type="Bearer")
 
 
 @router.post("/verify_send", summary="Send key for verification User",)
@@ -65,27 +77,18 @@ async def simple_send(current_user: User = Depends(get_current_user)):
 
     token = create_jwt_for_verify_email(current_user.email)
     html = f"""<p>{token}</p>"""
-
-    message = MessageSchema(
-        subject="Your Token will be expired in an hour",
-        recipients=[current_user.email, ],
-        body=html,
-        subtype=MessageType.html)
-
-    try:
-        # # Send email for verify user
-        # fm = FastMail(conf)
-        # await fm.send_message(message)
-        print(token)
-        return HTTPException(status_code=200, detail=f"Letter for {current_user.email} was sent with Token")
-    except Exception as ex:
-        raise HTTPException(status_code=404, detail=f" Something is wrong {ex}")
+    await enqueue_email([current_user.email], "Your Token will be expired in an hour", html)
+    return HTTPException(status_code=200, detail=f"Letter for {current_user.email} was queued with Token")
 
 
 @router.delete("/delete/{user_id}", summary='Delete User for Admin or Owner')
 async def delete_user(user_id: int, current_user: User = Depends(get_current_user)):
     if current_user.is_superuser or user_id == current_user.id:
+        emails = await User.filter(id=user_id).values_list("email", flat=True)
         deleted_account = await User.filter(id=user_id).delete()
+        for email in emails:
+            await invalidate_user(email)
+        await revoke_tokens(user_id)
     else:
         raise HTTPException(status_code=403, detail=f"User {current_user.email} forbidden")
     if not deleted_account:
@@ -99,6 +102,7 @@ async def update_user(user_id: int, data: UserUpdate, current_user: User = Depen
         user = await User.filter(id=user_id).first()
         if user:
             await User.filter(id=user_id).update(**data.model_dump(exclude_unset=True))
+            await invalidate_user(user.email)
             return await UserPydantic.from_queryset_single(User.get(id=user_id))
         else:
             raise HTTPException(status_code=404, detail=f"User {user_id} isn't found")
@@ -107,16 +111,46 @@ async def update_user(user_id: int, data: UserUpdate, current_user: User = Depen
 
 
 @router.get("/user_list", summary='Get Users for Staff', response_model=List[UserPydantic])
-async def get_users(current_user: User = Depends(get_current_user)):
+async def get_users(fields: Optional[str] = Query(None, description="Comma separated subset, e.g. id,email"),
+                    current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        selected = parse_fields(fields, UserPydantic)
+        if selected:
+            return FastJSONResponse(validate_subset(await User.all().values(*selected), UserPydantic, selected))
+        return FastJSONResponse(await User.all().values(*UserPydantic.model_fields))
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} forbidden")
+
+
+@router.get("/user_export", summary='Export Users as NDJSON or CSV stream for Staff')
+async def export_users(fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                       current_user: User = Depends(get_current_user)):
+    if current_user.is_staff:
+        fields = ("id", "email", "phone", "full_name", "is_active", "is_verified", "is_staff", "is_superuser")
+        return export_response(User.all(), fields, fmt, "users", config.EXPORT_CHUNK_SIZE)
+    else:
+        raise HTTPException(status_code=403, detail=f"{current_user.email} forbidden")
+
+
+@router.get("/cache_stats", summary='Get cache counters for Staff')
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
     if current_user.is_staff:
-        return await UserPydantic.from_queryset(User.all())
+        return cache.stats()
     else:
         raise HTTPException(status_code=403, detail=f"{current_user.email} forbidden")
 
 
 @router.get("/user/{user_id}", summary='Get User for Staff or Owner', response_model=UserPydantic)
-async def get_user(user_id: int, current_user: User = Depends(get_current_user)):
+async def get_user(user_id: int,
+                   fields: Optional[str] = Query(None, description="Comma separated subset, e.g. id,email"),
+                   current_user: User = Depends(get_current_user)):
     if current_user.is_staff or user_id == current_user.id:
+        selected = parse_fields(fields, UserPydantic)
+        if selected:
+            rows = await User.filter(id=user_id).values(*selected)
+            if not rows:
+                raise HTTPException(status_code=404, detail=f"User {user_id} isn't found")
+            return FastJSONResponse(validate_subset(rows, UserPydantic, selected)[0])
         user = await User.filter(id=user_id).first()
         if user:
             return await UserPydantic.from_tortoise_orm(user)
@@ -136,6 +170,8 @@ async def set_is_active(user_id: int, current_user: User = Depends(get_current_u
             else:
                 user.is_active = True
             await user.save()
+            await revoke_tokens(user.id)
+            await invalidate_user(user.email)
             return await UserPydantic.from_tortoise_orm(user)
         else:
             raise HTTPException(status_code=403, detail=f"User {user_id} isn't found")
@@ -152,6 +188,7 @@ async def set_is_verify(token: TokenSchema):
         else:
             token_user.is_verified = True
             await token_user.save()
+            await invalidate_user(token_user.email)
             raise HTTPException(status_code=200, detail=f"User {token_user.email} is verified")
     else:
         raise HTTPException(status_code=404, detail=f"Invalid token")
@@ -167,6 +204,8 @@ async def set_is_staff(user_id: int,  current_user: User = Depends(get_current_u
             else:
                 user.is_staff = True
             await user.save()
+            await revoke_tokens(user.id)
+            await invalidate_user(user.email)
             return await UserPydantic.from_tortoise_orm(user)
         else:
             raise HTTPException(status_code=403, detail=f"User {user_id} isn't found")
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, EmailStr, constr, model_validator, ConfigDict
 
 
@@ -49,3 +51,29 @@ class TokenSchema(BaseModel):
 class TokenPayload(BaseModel):
     sub: str = None
     exp: int = None
+    uid: Optional[int] = None
+    role: Optional[str] = None
+    ver: Optional[int] = None
+
+
+class TokenUser(BaseModel):
+    """User restored from the token claims without database access"""
+    id: int
+    email: str
+    is_active: bool = True
+    is_staff: bool = False
+    is_superuser: bool = False
+
+
+class AuthUser(BaseModel):
+    """User of the request as kept in the shared cache, the password hash never leaves the database"""
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    email: str
+    phone: str
+    full_name: str
+    is_active: bool = True
+    is_verified: bool = False
+    is_staff: bool = False
+    is_superuser: bool = False
+    token_version: int = 0
@@ -1,57 +1,134 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
 from fastapi import Depends
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Union, Any
+from typing import Union, Any, Optional, Tuple
 import jwt
 from starlette import status
+from tortoise.expressions import F
 from src.users.models import User
-from src.users.schemas import TokenPayload
+from src.users.schemas import AuthUser, TokenPayload, TokenUser
 from fastapi import HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi_mail import ConnectionConfig
 from src import config
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=config.EMAIL_HOST_USER,
-    MAIL_PASSWORD=config.EMAIL_HOST_PASSWORD,
-    MAIL_FROM=config.EMAIL_HOST_USER,
-    MAIL_PORT=config.EMAIL_PORT,
-    MAIL_SERVER=config.EMAIL_HOST,
-    MAIL_FROM_NAME="Onion Store FastApi",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-)
-
+from src.cache import cache
+from src.db import primary
 
 JWT_SECRET_KEY = config.JWT_SECRET_KEY
 VERIFY_SECRET_KEY = config.VERIFY_SECRET_KEY
 ALGORITHM = config.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def create_password_context() -> CryptContext:
+    """
+    Hashes with a deprecated scheme, other bcrypt rounds or other argon2 time and memory cost
+    than configured are marked for update
+    """
+    settings = {}
+    if "bcrypt" in config.PASSWORD_SCHEMES:
+        settings.update(bcrypt__rounds=config.BCRYPT_ROUNDS, bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+                        bcrypt__max_rounds=config.BCRYPT_ROUNDS)
+    if "argon2" in config.PASSWORD_SCHEMES:
+        settings.update(argon2__time_cost=config.ARGON2_TIME_COST,
+                        argon2__min_rounds=config.ARGON2_TIME_COST,
+                        argon2__max_rounds=config.ARGON2_TIME_COST,
+                        argon2__memory_cost=config.ARGON2_MEMORY_COST,
+                        argon2__parallelism=config.ARGON2_PARALLELISM)
+    return CryptContext(schemes=config.PASSWORD_SCHEMES, deprecated="auto", **settings)
+
+
+@functools.lru_cache(maxsize=None)
+def get_password_context() -> CryptContext:
+    """Built on the first hash or verify, not at import"""
+    return create_password_context()
+
+
+def __getattr__(name):
+    if name == "password_context":
+        return get_password_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 oauth2_scheme = HTTPBearer()
 
 
-def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
+def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None, user: User = None) -> str:
     if expires_delta is not None:
         expires_delta = datetime.utcnow() + expires_delta
     else:
         expires_delta = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode = {"exp": expires_delta, "sub": str(subject)}
+    if user is not None and config.JWT_USER_CLAIMS:
+        to_encode.update(uid=user.id, role=get_role(user), ver=user.token_version)
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
     return encoded_jwt
 
 
+def get_role(user: User) -> str:
+    if user.is_superuser:
+        return "admin"
+    if user.is_staff:
+        return "staff"
+    return "user"
+
+
 def get_hashed_password(password: str) -> str:
-    return password_context.hash(password)
+    return get_password_context().hash(password)
 
 
 def verify_password(password: str, hashed_pass: str) -> bool:
-    return password_context.verify(password, hashed_pass)
+    return get_password_context().verify(password, hashed_pass)
+
+
+def verify_and_update_password(password: str, hashed_pass: str) -> Tuple[bool, Optional[str]]:
+    """(is valid, new hash when the stored one uses a deprecated scheme or cost)"""
+    return get_password_context().verify_and_update(password, hashed_pass)
+
+
+_hash_executor: Optional[Executor] = None
+_hash_jobs = 0
+
+
+def get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if config.HASH_POOL == "process":
+            _hash_executor = ProcessPoolExecutor(config.HASH_WORKERS)
+        else:
+            _hash_executor = ThreadPoolExecutor(config.HASH_WORKERS, thread_name_prefix="hash")
+    return _hash_executor
+
+
+async def run_hashing(func, *args):
+    """
+    Run a password hashing function in the worker pool, when all workers and queue slots
+    are taken answer 503 at once instead of queueing more work
+    """
+    global _hash_jobs
+    if _hash_jobs >= config.HASH_WORKERS + config.HASH_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _hash_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_hash_executor(), func, *args)
+    finally:
+        _hash_jobs -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await run_hashing(get_hashed_password, password)
+
+
+async def check_password(password: str, hashed_pass: str) -> Tuple[bool, Optional[str]]:
+    return await run_hashing(verify_and_update_password, password, hashed_pass)
 
 
 async def get_user_by_email_or_phone(email_or_phone: str):
@@ -63,7 +140,7 @@ async def get_user_by_email_or_phone(email_or_phone: str):
     return user
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> User:
+def decode_access_token(credentials: HTTPAuthorizationCredentials) -> TokenPayload:
     try:
         token = credentials.credentials
         payload = jwt.decode(
@@ -82,8 +159,20 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(o
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return token_data
+
+
+def revoked_token() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token revoked",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
-    user = await User.filter(email=token_data.sub).first()
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> AuthUser:
+    token_data = decode_access_token(credentials)
+    user = await get_cached_user(token_data.sub)
 
     if not user:
         raise HTTPException(
@@ -95,9 +184,68 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(o
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Inactive user",
         )
+    if token_data.ver is not None and token_data.ver != user.token_version:
+        raise revoked_token()
     return user
 
 
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) \
+        -> Union[AuthUser, TokenUser]:
+    """
+    For read-only routes: tokens with user claims are authorized by the cached token version,
+    plain tokens fall back to get_current_user
+    """
+    token_data = decode_access_token(credentials)
+    if token_data.uid is None or token_data.ver is None:
+        return await get_current_user(credentials)
+    if token_data.ver != await get_token_version(token_data.uid):
+        raise revoked_token()
+    return TokenUser(id=token_data.uid,
+                     email=token_data.sub,
+                     is_staff=token_data.role in ("staff", "admin"),
+                     is_superuser=token_data.role == "admin")
+
+
+def token_version_key(user_id: int) -> str:
+    return f"token_version:{user_id}"
+
+
+async def get_token_version(user_id: int) -> Optional[int]:
+    """Current token version of an active user, None for inactive or deleted ones"""
+    version = await cache.get(token_version_key(user_id))
+    if version is None:
+        versions = await User.filter(id=user_id, is_active=True).using_db(primary()) \
+            .values_list("token_version", flat=True)
+        if not versions:
+            return None
+        version = versions[0]
+        await cache.set(token_version_key(user_id), version, config.USER_CACHE_TTL)
+    return version
+
+
+async def revoke_tokens(user_id: int) -> None:
+    await User.filter(id=user_id).update(token_version=F("token_version") + 1)
+    await cache.delete(token_version_key(user_id))
+
+
+def user_key(email: str) -> str:
+    return f"user:{email}"
+
+
+async def get_cached_user(email: str) -> Optional[AuthUser]:
+    row = await cache.get(user_key(email))
+    if row is None:
+        row = await User.filter(email=email).using_db(primary()).first().values(*AuthUser.model_fields)
+        if row is None:
+            return None
+        await cache.set(user_key(email), row, config.USER_CACHE_TTL)
+    return AuthUser(**row)
+
+
+async def invalidate_user(email: str) -> None:
+    await cache.delete(user_key(email))
+
+
 def create_jwt_for_verify_email(email) -> str:
     expires_delta = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = {"exp": expires_delta, "sub": str(email)}
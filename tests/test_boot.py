@@ -0,0 +1,13 @@
+from asgi_lifespan import LifespanManager
+from httpx import AsyncClient
+
+from src.main import app
+
+
+async def test_boot_twice():
+    """The second boot runs generate_schemas against the schema made by the first one"""
+    for _ in range(2):
+        async with LifespanManager(app):
+            async with AsyncClient(app=app, base_url="http://test") as client:
+                response = await client.get("/metrics")
+                assert response.status_code == 200
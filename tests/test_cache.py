@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from src.cache import TTLCache, RedisCache, create_cache
+
+
+def test_ttl_cache_lru():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None, "least recently used is evicted"
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1}
+
+
+def test_ttl_cache_expire():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None, "expired"
+    assert len(cache) == 0
+    cache.set("b", 2)
+    cache.pop("b")
+    assert cache.get("b") is None, "invalidated"
+
+
+class FakeRedis:
+    """Tiny in-memory server speaking enough RESP2 for RedisCache"""
+
+    def __init__(self):
+        self.data = {}
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{port}/1"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        while line := await reader.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                size = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(size + 2))[:-2].decode())
+            writer.write(self.reply(args[0].upper(), args[1:]))
+            await writer.drain()
+        writer.close()
+
+    def reply(self, command, args):
+        if command in ("SELECT", "AUTH"):
+            return b"+OK\r\n"
+        if command == "GET":
+            value = self.data.get(args[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value.encode()), value.encode())
+        if command == "SET":
+            self.data[args[0]] = args[1]
+            return b"+OK\r\n"
+        if command == "DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        if command == "INCR":
+            self.data[args[0]] = str(int(self.data.get(args[0], 0)) + 1)
+            return b":%s\r\n" % self.data[args[0]].encode()
+        return b"-ERR unknown command\r\n"
+
+
+async def test_memory_cache():
+    cache = create_cache("memory://", prefix="t:", maxsize=10)
+    assert await cache.get("a") is None
+    await cache.set("a", {"id": 1}, ttl=60)
+    assert await cache.get("a") == {"id": 1}
+    assert await cache.incr("gen") == 1
+    assert await cache.get_int("gen") == 1
+    await cache.delete("a")
+    assert await cache.get("a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+    for i in range(20):
+        await cache.set(f"k{i}", i, ttl=60)
+    assert await cache.get_int("gen") == 1, "counters aren't evicted"
+
+
+async def test_redis_cache_shared_between_workers():
+    fake = FakeRedis()
+    url = await fake.start()
+    worker_1 = create_cache(url, prefix="t:")
+    worker_2 = create_cache(url, prefix="t:")
+    assert isinstance(worker_1, RedisCache)
+
+    await worker_1.set("product:1", {"id": 1, "name": "onion"}, ttl=60)
+    assert await worker_2.get("product:1") == {"id": 1, "name": "onion"}, "visible for other worker"
+    assert fake.data["t:product:1"]
+
+    await worker_2.delete("product:1")
+    assert await worker_1.get("product:1") is None, "invalidation reaches other worker"
+
+    assert await worker_1.incr("gen") == 1
+    assert await worker_2.incr("gen") == 2
+    assert await worker_1.get_int("gen") == 2
+
+    await worker_1.close()
+    await worker_2.close()
+    await fake.stop()
+    assert await worker_1.get("product:1") is None, "backend down is a miss"
+    await worker_1.delete("product:1")
+    assert await worker_1.incr("gen") is None, "writes aren't failed by the cache"
+
+
+async def test_redis_cache_timeout():
+    server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    cache = create_cache(f"redis://127.0.0.1:{port}", timeout=0.05)
+    started = time.monotonic()
+    assert await cache.get("a") is None, "hung backend is a miss"
+    await cache.delete("a")
+    assert time.monotonic() - started < 1
+    server.close()
@@ -0,0 +1,39 @@
+from httpx import AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from src.db import ReadYourWritesMiddleware, ReplicaRouter, PRIMARY_COOKIE
+
+router = ReplicaRouter()
+
+
+async def read(request):
+    return PlainTextResponse(router.db_for_read(None))
+
+
+async def write(request):
+    router.db_for_write(None)
+    return PlainTextResponse(router.db_for_read(None))
+
+
+app = Starlette(routes=[Route("/read", read), Route("/write", write, methods=["POST"])])
+app.add_middleware(ReadYourWritesMiddleware, sticky_seconds=5)
+
+
+async def test_read_your_writes():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/read")
+        assert response.text == "replica", "reads go to replica"
+        assert PRIMARY_COOKIE not in response.cookies
+
+        response = await client.post("/write")
+        assert response.text == "default", "read after write in the same request"
+        assert response.cookies[PRIMARY_COOKIE] == "1"
+
+        response = await client.get("/read")
+        assert response.text == "default", "client is pinned after its write"
+
+        client.cookies.clear()
+        response = await client.get("/read")
+        assert response.text == "replica"
@@ -0,0 +1,73 @@
+import asyncio
+from email import message_from_bytes
+
+from src import config
+from src.mail.models import EmailJob
+from src.mail.utils import SMTPConnection, build_message
+
+
+class SMTPStub:
+    """Local SMTP server keeping received messages, reject makes every DATA fail with a temporary error"""
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.reject = False
+        self.server = None
+
+    async def start(self, monkeypatch) -> None:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        monkeypatch.setattr(config, "EMAIL_HOST", "127.0.0.1")
+        monkeypatch.setattr(config, "EMAIL_PORT", self.server.sockets[0].getsockname()[1])
+        monkeypatch.setattr(config, "EMAIL_USE_TLS", False)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 stub ESMTP\r\n")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                writer.write(b"250-stub\r\n250 AUTH PLAIN LOGIN\r\n")
+            elif command.startswith("AUTH"):
+                writer.write(b"235 ok\r\n")
+            elif command.startswith("DATA"):
+                if self.reject:
+                    writer.write(b"451 try later\r\n")
+                else:
+                    writer.write(b"354 go\r\n")
+                    await writer.drain()
+                    data = await reader.readuntil(b"\r\n.\r\n")
+                    self.messages.append(message_from_bytes(data[:-5]))
+                    writer.write(b"250 queued\r\n")
+            elif command.startswith("QUIT"):
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+
+async def wait_for(predicate, timeout=5.0):
+    for _ in range(int(timeout / 0.05)):
+        if await predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def test_smtp_connection_reused(monkeypatch):
+    stub = SMTPStub()
+    await stub.start(monkeypatch)
+    connection = SMTPConnection()
+    for i in range(3):
+        await connection.send(build_message(EmailJob(recipients=["a@test.com"], subject=f"s{i}", body="b")))
+    await connection.close()
+    await stub.stop()
+    assert [m["Subject"] for m in stub.messages] == ["s0", "s1", "s2"]
+    assert stub.connections == 1, "one session for the batch"
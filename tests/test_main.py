@@ -1,13 +1,30 @@
 import asyncio
+import importlib
+import json
 import random
+from datetime import date, datetime, timedelta, timezone
 
 import pytest
 from asgi_lifespan import LifespanManager
 from httpx import AsyncClient
+from passlib.context import CryptContext
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from src import config
 from src.main import app
-from src.sales.models import Product, Deal
-from src.users.models import User
-from src.users.utils import create_access_token, create_jwt_for_verify_email, get_hashed_password
+from src.cache import cache
+from src.db import PRIMARY_COOKIE, ReadYourWritesMiddleware, ReplicaRouter
+from src.mail.models import EmailJob
+from src.mail.utils import SMTPConnection, enqueue_email, send_due_emails
+from src.pagination import encode_cursor
+from src.profiling import query_shape, summarize
+from src.responses import dumps
+from src.sales.models import Product, Deal, Product_Pydantic
+from src.sales.utils import invalidate_products
+from src.users.models import User, UserPydantic
+from src.users.utils import create_access_token, create_jwt_for_verify_email, get_hashed_password, invalidate_user, \
+    password_context, user_key
+from tests.test_mail import SMTPStub, wait_for
 
 
 @pytest.fixture(scope="session")
@@ -64,6 +81,7 @@ async def get_user() -> User:
                    "phone": f"+7999{random_num}9999",
                    "hashed_password": get_hashed_password("Qwerty123!")}
     test_user = await User.create(**test_user_2)
+    await invalidate_user(test_user.email)
     return test_user
 
 
@@ -75,6 +93,7 @@ async def get_user_for_delete() -> User:
                    "phone": f"+7999{random_num}9899",
                    "hashed_password": get_hashed_password("Qwerty123!")}
     test_user = await User.create(**test_user_2)
+    await invalidate_user(test_user.email)
     return test_user
 
 
@@ -136,6 +155,52 @@ async def test_login_user(client: AsyncClient, get_user):
     await user.delete()
 
 
+@pytest.mark.anyio
+async def test_login_rehash(client: AsyncClient, get_user):
+    user = await get_user
+    user.hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("Qwerty123!")
+    await user.save()
+    response = await client.post("/users/login", json={"email_or_phone": user.email, "password": "Qwerty123!"})
+    assert response.status_code == 200, "login with weak hash"
+
+    await user.refresh_from_db()
+    assert not password_context.needs_update(user.hashed_password), "rehashed with configured cost"
+    stronger = user.hashed_password.replace(f"${config.BCRYPT_ROUNDS:02d}$", f"${config.BCRYPT_ROUNDS + 1:02d}$", 1)
+    assert password_context.needs_update(stronger), "higher cost than configured is rehashed too"
+    response = await client.post("/users/login", json={"email_or_phone": user.email, "password": "Qwerty123!"})
+    assert response.status_code == 200, "login with new hash"
+    await user.delete()
+
+
+@pytest.mark.anyio
+async def test_login_busy(client: AsyncClient, get_user, monkeypatch):
+    user = await get_user
+    monkeypatch.setattr(config, "HASH_WORKERS", 0)
+    monkeypatch.setattr(config, "HASH_QUEUE_SIZE", 0)
+    response = await client.post("/users/login", json={"email_or_phone": user.email, "password": "Qwerty123!"})
+    assert response.status_code == 503, "hashing pool is full"
+    await user.delete()
+
+
+@pytest.mark.anyio
+async def test_login_user_claims(client: AsyncClient, get_user, get_headers_admin, monkeypatch):
+    user = await get_user
+    monkeypatch.setattr(config, "JWT_USER_CLAIMS", True)
+    response = await client.post("/users/login", json={"email_or_phone": user.email, "password": "Qwerty123!"})
+    token = response.json()["access_token"]
+    headers = {'Authorization': f'Bearer {token}'}
+    response = await client.get("/product/product_list", headers=headers)
+    assert response.status_code == 200, "authorized by claims"
+
+    response = await client.post(f"/users/staff/{user.id}", headers=get_headers_admin)
+    assert response.status_code == 200, "role changed"
+    response = await client.get("/product/product_list", headers=headers)
+    assert response.status_code == 401, "token revoked"
+    response = await client.get(f"/users/user/{user.id}", headers=headers)
+    assert response.status_code == 401, "token revoked for full user path"
+    await user.delete()
+
+
 @pytest.mark.anyio
 async def test_verify_send(client: AsyncClient, get_headers_user):
     response = await client.post("/users/verify_send", headers=get_headers_user)
@@ -167,6 +232,22 @@ async def test_users_list(client: AsyncClient, get_headers_user, get_headers_adm
     assert response.status_code == 200, "admin user"
 
 
+@pytest.mark.anyio
+async def test_users_export(client: AsyncClient, get_headers_user, get_headers_admin, monkeypatch):
+    monkeypatch.setattr(config, "EXPORT_CHUNK_SIZE", 1)
+    response = await client.get("/users/user_export", headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.get("/users/user_export", headers=get_headers_admin)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == await User.all().count(), "all chunks streamed"
+    assert "hashed_password" not in rows[0]
+
+    response = await client.get("/users/user_export?format=csv", headers=get_headers_admin)
+    assert response.text.splitlines()[0].startswith("id,email"), "csv header"
+
+
 @pytest.mark.anyio
 async def test_user_num(client: AsyncClient, get_user, get_headers_user, get_headers_admin):
     user_curr = await get_user
@@ -211,9 +292,24 @@ async def test_user_active(client: AsyncClient, get_user, get_headers_admin):
 
     response = await client.post(f"/users/active/{user_curr.id}", headers=get_headers_admin)
     assert response.status_code == 200, "admin"
+
+    response = await client.get(f"/users/user/{user_curr.id}", headers=headers)
+    assert response.status_code == 404, "cached user is invalidated"
     await user_curr.delete()
 
 
+@pytest.mark.anyio
+async def test_cache_stats(client: AsyncClient, get_headers_user, get_headers_admin):
+    response = await client.get("/users/cache_stats", headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.get("/users/cache_stats", headers=get_headers_admin)
+    assert response.status_code == 200, "admin"
+    assert response.json()["hits"] >= 1
+    cached = await cache.get(user_key("test_not_admin2@test.com"))
+    assert cached["email"] == "test_not_admin2@test.com" and "hashed_password" not in cached
+
+
 @pytest.mark.anyio
 async def test_user_staff(client: AsyncClient, get_headers_admin, get_user):
     user_curr = await get_user
@@ -260,6 +356,38 @@ async def test_create_product(client: AsyncClient, get_headers_admin, get_header
     await Product.filter(id=p_id).delete()
 
 
+@pytest.mark.anyio
+async def test_bulk_import(client: AsyncClient, get_headers_admin, get_headers_user, get_product):
+    prod = await get_product
+    body = "\n".join([
+        '{"name": "bulk_test1", "price": 10, "photo": "p"}',
+        '{"name": "bulk_test2", "price": -1, "photo": "p"}',
+        f'{{"name": "{prod.name}", "price": 555, "photo": "p"}}',
+        'not json',
+    ]).encode() + b'\n{"name": "bulk_test\xff", "price": 1, "photo": "p"}'
+    response = await client.get(f"/product/{prod.id}", headers=get_headers_user)
+    etag = response.headers["etag"]
+    response = await client.post("/product/bulk_import", content=body, headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.post("/product/bulk_import", content=body, headers=get_headers_admin)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["updated"]) == (1, 1)
+    assert [e["row"] for e in result["errors"]] == [2, 4, 5], "bad rows reported"
+    assert (await Product.get(id=prod.id)).price == 555, "upsert by name"
+    response = await client.get(f"/product/{prod.id}", headers={**get_headers_user, "If-None-Match": etag})
+    assert response.status_code == 200 and response.json()["price"] == 555, "cached product invalidated"
+
+    csv_body = "name,price,photo\nbulk_test1,11,p\nbulk_test3,12,p\n"
+    headers = {**get_headers_admin, "Content-Type": "text/csv"}
+    response = await client.post("/product/bulk_import?upsert=false", content=csv_body, headers=headers)
+    result = response.json()
+    assert result["created"] == 1 and result["errors"][0]["row"] == 2, "existing row rejected"
+    await Product.filter(name__startswith="bulk_test").delete()
+    await prod.delete()
+
+
 @pytest.mark.anyio
 async def test_product_list(client: AsyncClient, get_headers_user, get_product):
     prod = await get_product
@@ -271,6 +399,104 @@ async def test_product_list(client: AsyncClient, get_headers_user, get_product):
     await prod.delete()
 
 
+@pytest.mark.anyio
+async def test_fast_json_lists(client: AsyncClient, get_headers_user, get_headers_admin, get_product):
+    prod = await get_product
+    await invalidate_products()
+    response = await client.get("/product/product_list?size=100", headers=get_headers_user)
+    assert response.headers["etag"]
+    expected = [p.model_dump(mode="json") for p in await Product_Pydantic.from_queryset(
+        Product.filter(is_active=True).limit(100))]
+    assert response.json()["items"] == expected, "rows serialized like Product_Pydantic"
+    cached = await client.get("/product/product_list?size=100", headers=get_headers_user)
+    assert cached.content == response.content and cached.headers["etag"] == response.headers["etag"]
+
+    response = await client.get("/users/user_list", headers=get_headers_admin)
+    expected = [u.model_dump(mode="json") for u in await UserPydantic.from_queryset(User.all())]
+    assert response.json() == expected, "rows serialized like UserPydantic"
+    assert dumps({"at": datetime(2026, 1, 2, tzinfo=timezone.utc)}) == b'{"at":"2026-01-02T00:00:00Z"}'
+    await prod.delete()
+
+
+@pytest.mark.anyio
+async def test_sparse_fields(client: AsyncClient, get_headers_user, get_headers_admin, get_product):
+    prod = await get_product
+    response = await client.get("/product/product_list?fields=price,id,name", headers=get_headers_user)
+    assert response.status_code == 200
+    assert all(list(item) == ["id", "name", "price"] for item in response.json()["items"]), "schema order"
+    full = await client.get("/product/product_list", headers=get_headers_user)
+    assert "photo" in full.json()["items"][0], "cached page of another projection isn't reused"
+
+    response = await client.get(f"/product/{prod.id}?fields=id,price", headers=get_headers_user)
+    assert response.json() == {"id": prod.id, "price": prod.price}
+    response = await client.get(f"/product/search?q={prod.name}&fields=name", headers=get_headers_user)
+    assert response.json()["items"] == [{"name": prod.name}]
+    response = await client.get("/users/user_list?fields=id,email", headers=get_headers_admin)
+    assert all(set(user) == {"id", "email"} for user in response.json())
+
+    response = await client.get("/product/product_list?fields=id,secret", headers=get_headers_user)
+    assert response.status_code == 400, "unknown field"
+    await prod.delete()
+
+
+@pytest.mark.anyio
+async def test_product_list_page(client: AsyncClient, get_headers_user, get_product):
+    prod = await get_product
+    response = await client.get("/product/product_list?page=1&size=1", headers=get_headers_user)
+    assert response.status_code == 200, "authenticated"
+    page = response.json()
+    assert len(page["items"]) == 1, "limited by size"
+    assert page["total"] >= 1, "total from count"
+    await prod.delete()
+
+
+@pytest.mark.anyio
+async def test_product_cursor(client: AsyncClient, get_headers_user):
+    prods = [await Product.create(name=f"cursor_test{i}", price=10, photo="test") for i in range(3)]
+    response = await client.get("/product/product_cursor?size=2", headers=get_headers_user)
+    assert response.status_code == 200, "first page"
+    first = response.json()
+    assert len(first["items"]) == 2 and first["prev_cursor"] is None
+
+    response_2 = await client.get(f"/product/product_cursor?size=2&cursor={first['next_cursor']}",
+                                  headers=get_headers_user)
+    second = response_2.json()
+    assert second["items"][0]["name"] > first["items"][-1]["name"], "seek after last key"
+
+    response_3 = await client.get(f"/product/product_cursor?size=2&cursor={second['prev_cursor']}",
+                                  headers=get_headers_user)
+    assert response_3.json()["items"] == first["items"], "back to first page"
+
+    response_4 = await client.get("/product/product_cursor?cursor=broken", headers=get_headers_user)
+    assert response_4.status_code == 400, "invalid cursor"
+    forged = encode_cursor(["cursor_test1", "not an id"])
+    response_5 = await client.get(f"/product/product_cursor?cursor={forged}", headers=get_headers_user)
+    assert response_5.status_code == 400, "cursor value of wrong type"
+    for prod in prods:
+        await prod.delete()
+
+
+@pytest.mark.anyio
+async def test_product_search(client: AsyncClient, get_headers_user):
+    prods = [await Product.create(name="Search_Onion Red", price=10, photo="p"),
+             await Product.create(name="search_onion white", price=50, photo="p"),
+             await Product.create(name="search_garlic", price=20, photo="p", is_active=False)]
+    response = await client.get("/product/search?q=ONION", headers=get_headers_user)
+    assert response.status_code == 200
+    assert [p["name"] for p in response.json()["items"]] == ["Search_Onion Red", "search_onion white"]
+
+    response = await client.get("/product/search?q=search_o&prefix=true&max_price=20", headers=get_headers_user)
+    assert [p["name"] for p in response.json()["items"]] == ["Search_Onion Red"], "prefix and price"
+
+    response = await client.get("/product/search?q=search&is_active=false", headers=get_headers_user)
+    assert [p["name"] for p in response.json()["items"]] == ["search_garlic"], "inactive only"
+
+    response = await client.get("/product/search?q=onion")
+    assert response.status_code == 403, "not authenticated"
+    for prod in prods:
+        await prod.delete()
+
+
 @pytest.mark.anyio
 async def test_product_get(client: AsyncClient, get_headers_user, get_product):
     prod = await get_product
@@ -282,6 +508,36 @@ async def test_product_get(client: AsyncClient, get_headers_user, get_product):
     await prod.delete()
 
 
+@pytest.mark.anyio
+async def test_product_conditional_get(client: AsyncClient, get_headers_user, get_headers_admin, get_product):
+    prod = await get_product
+    response = await client.get(f"/product/{prod.id}", headers=get_headers_user)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == config.PRODUCT_CACHE_CONTROL
+
+    response = await client.get(f"/product/{prod.id}", headers={**get_headers_user, "If-None-Match": etag})
+    assert response.status_code == 304, "etag matches"
+    response = await client.get(f"/product/{prod.id}",
+                                headers={**get_headers_user, "If-Modified-Since": response.headers["last-modified"]})
+    assert response.status_code == 304, "not modified since"
+
+    data = {"name": prod.name, "price": 999, "photo": "new"}
+    await asyncio.sleep(0.01)
+    await client.put(f"/product/{prod.id}", json=data, headers=get_headers_admin)
+    response = await client.get(f"/product/{prod.id}", headers={**get_headers_user, "If-None-Match": etag})
+    assert response.status_code == 200, "changed product"
+    assert response.headers["etag"] != etag
+
+    response = await client.get("/product/product_list", headers=get_headers_user)
+    list_etag = response.headers["etag"]
+    response = await client.get("/product/product_list", headers={**get_headers_user, "If-None-Match": list_etag})
+    assert response.status_code == 304, "list etag matches"
+    await client.post(f"/product/{prod.id}", headers=get_headers_admin)
+    response = await client.get("/product/product_list", headers={**get_headers_user, "If-None-Match": list_etag})
+    assert response.status_code == 200, "list changed"
+    await prod.delete()
+
+
 @pytest.mark.anyio
 async def test_product_update(client: AsyncClient, get_headers_user, get_headers_admin, get_product):
     prod = await get_product
@@ -327,6 +583,72 @@ async def test_basket_add(client: AsyncClient, get_headers_user, get_product):
     await prod.delete()
 
 
+@pytest.mark.anyio
+async def test_checkout(client: AsyncClient, get_user):
+    user_curr = await get_user
+    token = create_access_token(user_curr.email)
+    headers = {'Authorization': f'Bearer {token}'}
+    prod_1 = await Product.create(name="checkout_test1", price=10, photo="p")
+    prod_2 = await Product.create(name="checkout_test2", price=20, photo="p")
+    prod_3 = await Product.create(name="checkout_test3", price=30, photo="p", is_active=False)
+
+    items = [{"product_id": prod_1.id, "count": 2}, {"product_id": prod_2.id, "count": 1}]
+    response = await client.post("/product/checkout", json=items, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["total"] == 40
+    assert await Deal.filter(user=user_curr).count() == 2
+
+    response = await client.post("/product/checkout", json=items + [{"product_id": prod_3.id, "count": 1}],
+                                 headers=headers)
+    assert response.status_code == 400, "inactive product"
+    assert await Deal.filter(user=user_curr).count() == 2, "nothing added"
+
+    response = await client.post("/product/checkout", json=[{"product_id": 0, "count": 1}], headers=headers)
+    assert response.status_code == 404, "unknown product"
+    for prod in (prod_1, prod_2, prod_3):
+        await prod.delete()
+    await user_curr.delete()
+
+
+@pytest.mark.anyio
+async def test_basket_summary(client: AsyncClient, get_user, get_headers_admin):
+    user_curr = await get_user
+    token = create_access_token(user_curr.email)
+    headers = {'Authorization': f'Bearer {token}'}
+    prod_1 = await Product.create(name="summary_test1", price=10, photo="p")
+    prod_2 = await Product.create(name="summary_test2", price=20, photo="p")
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 0, "total": 0}, "empty basket"
+
+    await client.post(f"/product/deal/{prod_1.id}&3", headers=headers)
+    await client.post("/product/checkout", json=[{"product_id": prod_2.id, "count": 2}], headers=headers)
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 5, "total": 70}, "deal and checkout counted"
+    assert (await client.get("/product/deal/0", headers=headers)).json()["total"] == 70
+
+    deal = await Deal.get(user=user_curr, product=prod_1)
+    await client.delete(f"/product/deal/{deal.id}", headers=headers)
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 2, "total": 40}, "deleted deal subtracted"
+
+    await Deal.create(user=user_curr, product=prod_1, count=1, price=10)
+    response = await client.post("/product/basket_reconcile", headers=headers)
+    assert response.status_code == 403, "not admin"
+    response = await client.post("/product/basket_reconcile", headers=get_headers_admin)
+    assert response.json()["repaired"] >= 1, "drift repaired"
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 3, "total": 50}
+
+    await client.delete(f"/product/{prod_2.id}", headers=get_headers_admin)
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 1, "total": 10}, "deals of deleted product removed"
+    await client.delete("/product/deal/0", headers=headers)
+    response = await client.get("/product/basket_summary", headers=headers)
+    assert response.json() == {"count": 0, "total": 0}
+    await prod_1.delete()
+    await user_curr.delete()
+
+
 @pytest.mark.anyio
 async def test_basket_get(client: AsyncClient, get_headers_user, get_product):
     prod = await get_product
@@ -335,12 +657,52 @@ async def test_basket_get(client: AsyncClient, get_headers_user, get_product):
     deal = await Deal.create(**data_deal)
     response = await client.get(f"/product/deal/{deal.id}", headers=get_headers_user)
     assert response.status_code == 200
+    assert response.json()["total"] == 102, "sum of one deal"
+    assert response.json()["basket"][0]["product"]["id"] == prod.id
 
     response_2 = await client.get(f"/product/deal/0", headers=get_headers_user)
     assert response_2.status_code == 200
     await prod.delete()
 
 
+@pytest.mark.anyio
+async def test_basket_cursor(client: AsyncClient, get_product, get_user):
+    prod = await get_product
+    user_curr = await get_user
+    for _ in range(3):
+        await Deal.create(user=user_curr, product=prod, count=1, price=102)
+    token = create_access_token(user_curr.email)
+    headers = {'Authorization': f'Bearer {token}'}
+    response = await client.get("/product/deal_cursor?size=2", headers=headers)
+    assert response.status_code == 200
+    first = response.json()
+    assert len(first["items"]) == 2
+
+    response_2 = await client.get(f"/product/deal_cursor?size=2&cursor={first['next_cursor']}", headers=headers)
+    second = response_2.json()
+    assert len(second["items"]) == 1 and second["next_cursor"] is None
+    await prod.delete()
+    await user_curr.delete()
+
+
+@pytest.mark.anyio
+async def test_deal_export(client: AsyncClient, get_headers_admin, get_headers_user, get_product):
+    prod = await get_product
+    user_curr = await User.get(email="test_not_admin2@test.com")
+    await Deal.create(user=user_curr, product=prod, count=2, price=204)
+    response = await client.get("/product/deal_export?format=csv", headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.get("/product/deal_export?format=csv", headers=get_headers_admin)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert f"{prod.id},2,204" in response.text
+
+    response = await client.get("/product/product_export", headers=get_headers_admin)
+    assert any(json.loads(line)["id"] == prod.id for line in response.text.splitlines())
+    await prod.delete()
+
+
 @pytest.mark.anyio
 async def test_basket_delete(client: AsyncClient, get_product, get_user):
     prod = await get_product
@@ -360,3 +722,197 @@ async def test_basket_delete(client: AsyncClient, get_product, get_user):
     assert response_3.status_code == 404
     await prod.delete()
     await user_curr.delete()
+
+
+@pytest.mark.anyio
+async def test_pool_stats(client: AsyncClient, get_headers_user, get_headers_admin):
+    response = await client.get("/monitoring/pool", headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.get("/monitoring/pool", headers=get_headers_admin)
+    assert response.status_code == 200
+    for stats in response.json().values():
+        assert stats["in_use"] + stats["idle"] == stats["size"]
+        assert stats["waiters"] >= 0
+
+
+@pytest.mark.anyio
+async def test_read_your_writes_on_deal_writes(client: AsyncClient, get_user, get_product):
+    user_curr = await get_user
+    prod = await get_product
+    headers = {'Authorization': f'Bearer {create_access_token(user_curr.email)}'}
+    writes = ((f"/product/deal/{prod.id}&1", "POST", None),
+              ("/product/checkout", "POST", [{"product_id": prod.id, "count": 1}]),
+              ("/product/deal/0", "DELETE", None))
+    async with AsyncClient(app=ReadYourWritesMiddleware(app), base_url="http://test") as pinned:
+        response = await pinned.get("/product/deal/0", headers=headers)
+        assert PRIMARY_COOKIE not in response.cookies, "reads don't pin"
+        for url, method, body in writes:
+            pinned.cookies.clear()
+            response = await pinned.request(method, url, json=body, headers=headers)
+            assert response.status_code == 200
+            assert response.cookies[PRIMARY_COOKIE] == "1", f"{method} {url} pins the client to the primary"
+    await prod.delete()
+    await user_curr.delete()
+
+
+@pytest.mark.anyio
+async def test_replica_router_in_transaction(client: AsyncClient):
+    async with in_transaction("default"):
+        assert ReplicaRouter().db_for_read(Product) == "default", "reads inside transaction stay on primary"
+
+
+@pytest.mark.anyio
+async def test_metrics(client: AsyncClient, get_headers_user, get_product):
+    prod = await get_product
+    await client.get("/product/deal/0", headers=get_headers_user)
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="/product/deal/{d_id}"')
+               for line in lines), "latency by route template"
+    queries = [line for line in lines if line.startswith('http_db_queries_total{method="GET",route="/product/deal/{d_id}"')]
+    assert queries and int(queries[0].split()[-1]) > 0, "db queries counted"
+    await prod.delete()
+
+
+async def explain(sql: str) -> str:
+    async with in_transaction("default") as conn:
+        if conn.capabilities.dialect == "postgres":
+            await conn.execute_script("SET LOCAL enable_seqscan = off")
+            _, rows = await conn.execute_query(f"EXPLAIN {sql}")
+        else:
+            _, rows = await conn.execute_query(f"EXPLAIN QUERY PLAN {sql}")
+    return " ".join(str(value) for row in rows for value in dict(row).values())
+
+
+@pytest.mark.anyio
+async def test_hot_path_indexes(client: AsyncClient):
+    plan = await explain('SELECT * FROM "deal" WHERE "user_id" = 1 ORDER BY "id"')
+    assert "idx_deal_user_id_bd2ebe" in plan, "basket by user"
+
+    plan = await explain('SELECT * FROM "deal" WHERE "product_id" = 1')
+    assert "idx_deal_product_81017a" in plan, "deals by product"
+
+    plan = await explain('SELECT * FROM "product" WHERE "is_active" = true ORDER BY "name" LIMIT 50')
+    assert "idx_product_name_active" in plan, "active products by name"
+
+
+@pytest.mark.anyio
+async def test_search_trigram_index(client: AsyncClient):
+    conn = Tortoise.get_connection("default")
+    if conn.capabilities.dialect != "postgres":
+        pytest.skip("pg_trgm index exists on PostgreSQL only")
+    migration = importlib.import_module("migrations.aerich.3_20261018140000_product_name_trigram")
+    await conn.execute_script(await migration.upgrade(conn))
+    sql = Product.filter(name__icontains="onion").sql()
+    plan = await explain(sql)
+    assert "idx_product_name_trgm" in plan, "substring search uses trigram index"
+
+
+@pytest.mark.anyio
+async def test_query_profile(client: AsyncClient, get_headers_user, monkeypatch, caplog):
+    response = await client.get("/product/product_list", headers=get_headers_user)
+    assert "x-query-profile" not in response.headers, "profiler is off by default"
+
+    monkeypatch.setattr(config, "PROFILE_QUERIES", "header")
+    monkeypatch.setattr(config, "N_PLUS_ONE_THRESHOLD", 2)
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", 0)
+    response = await client.get("/product/product_list", headers=get_headers_user)
+    assert "x-query-profile" not in response.headers, "header mode needs the request header"
+
+    with caplog.at_level("INFO"):
+        response = await client.get("/product/search?q=onion",
+                                    headers={**get_headers_user, "X-Profile-Queries": "1"})
+    assert response.status_code == 200
+    assert response.headers["x-query-profile"].startswith("queries=")
+    assert any("slow query" in r.message and "/product/search" in r.message for r in caplog.records)
+    profile = [json.loads(r.message) for r in caplog.records if r.name == "src.profiling" and r.message.startswith("{")]
+    assert profile and profile[0]["route"] == "/product/search"
+    assert profile[0]["queries"] == len(profile[0]["statements"]) > 0
+
+
+def test_query_shape():
+    assert query_shape('SELECT * FROM "deal" WHERE "id"=3') == query_shape('SELECT * FROM "deal" WHERE "id"=42')
+    assert query_shape("SELECT 1 FROM t WHERE x IN ('a','b', 'c')") == "SELECT ? FROM t WHERE x IN (?)"
+    summary = summarize([(f'SELECT * FROM "product" WHERE "id"={i}', 0.001) for i in range(6)])
+    assert summary["repeated"][0]["count"] == 6, "N+1 shape detected"
+
+
+@pytest.mark.anyio
+async def test_analytics(client: AsyncClient, get_user, get_headers_user, get_headers_admin):
+    user_curr = await get_user
+    prod_1 = await Product.create(name="analytics_test1", price=10, photo="p")
+    prod_2 = await Product.create(name="analytics_test2", price=1000, photo="p")
+    await Deal.create(user=user_curr, product=prod_1, count=50, price=500)
+    await Deal.create(user=user_curr, product=prod_2, count=1, price=1000)
+    old = await Deal.create(user=user_curr, product=prod_1, count=1, price=10)
+    await Deal.filter(id=old.id).update(created_at=datetime.now(timezone.utc) - timedelta(days=40))
+
+    response = await client.get("/analytics/top_products", headers=get_headers_user)
+    assert response.status_code == 403, "not admin"
+
+    response = await client.post("/analytics/refresh?full=true", headers=get_headers_admin)
+    assert response.status_code == 200
+    assert response.json()["days"] >= 41, "full rebuild from the first deal"
+
+    response = await client.get("/analytics/products?limit=1000", headers=get_headers_admin)
+    sales = {row["product_id"]: row for row in response.json()}
+    assert sales[prod_1.id]["units"] == 51 and sales[prod_1.id]["revenue"] == 510
+    assert sales[prod_1.id]["deals"] == 2
+
+    response = await client.get(f"/analytics/top_products?n=1&by=units&date_from={date.today()}",
+                                headers=get_headers_admin)
+    assert response.json()[0]["product_id"] == prod_1.id, "top by units"
+    response = await client.get(f"/analytics/top_products?n=1&by=revenue&date_from={date.today()}",
+                                headers=get_headers_admin)
+    assert response.json()[0]["product_id"] == prod_2.id, "top by revenue"
+
+    response = await client.get(f"/analytics/users/{user_curr.id}/spend?period=month", headers=get_headers_admin)
+    spend = response.json()
+    assert spend["total"] == 1510
+    assert len(spend["points"]) == 2, "old deal in another month"
+
+    await Deal.create(user=user_curr, product=prod_2, count=1, price=1000)
+    response = await client.post("/analytics/refresh", headers=get_headers_admin)
+    assert response.json()["days"] == config.ANALYTICS_REFRESH_DAYS, "incremental refresh"
+    response = await client.get(f"/analytics/users/{user_curr.id}/spend", headers=get_headers_admin)
+    assert response.json()["total"] == 2510
+    for prod in (prod_1, prod_2):
+        await prod.delete()
+    await user_curr.delete()
+
+
+@pytest.mark.anyio
+async def test_mail_queue(client: AsyncClient, get_user, monkeypatch):
+    stub = SMTPStub()
+    await stub.start(monkeypatch)
+    user_curr = await get_user
+    headers = {'Authorization': f'Bearer {create_access_token(user_curr.email)}'}
+    response = await client.post("/users/verify_send", headers=headers)
+    assert response.status_code == 200
+
+    async def delivered():
+        return any(m["To"] == user_curr.email for m in stub.messages)
+    assert await wait_for(delivered), "worker sent the queued letter"
+
+    stub.reject = True
+    monkeypatch.setattr(config, "MAIL_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(config, "MAIL_RETRY_SECONDS", 0)
+    job = await enqueue_email(["retry@test.com"], "retry", "<p>retry</p>")
+    assert await wait_for(lambda: EmailJob.filter(id=job.id, status="failed").exists()), "retried then failed"
+    await job.refresh_from_db()
+    assert job.attempts == 2 and "try later" in job.last_error
+
+    stub.reject = False
+    job = await EmailJob.create(recipients=["restart@test.com"], subject="left", body="b", run_at=job.created_at)
+    connection = SMTPConnection()
+    await send_due_emails(connection)
+    await connection.close()
+    assert await wait_for(lambda: EmailJob.filter(id=job.id, status="sent").exists()), "job left in the table is sent"
+
+    job = await enqueue_email(["bad@test.com"], "bad\nheader", "<p>b</p>")
+    assert await wait_for(lambda: EmailJob.filter(id=job.id, status="failed").exists()), "bad message gives up"
+    await stub.stop()
+    await user_curr.delete()